@@ -0,0 +1,188 @@
+import asyncio
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+# ======================================================================
+# ASGI-вариант API.
+#
+# Маршруты и JSON те же, что у Flask-приложения: каждый запрос
+# передаётся в api.server.app, но обработчик (и его работа с SQLite)
+# выполняется в ограниченном пуле потоков. Соединения клиентов, ждущие
+# ответа или простаивающие между запросами (keep-alive, опрос статуса),
+# держит цикл событий ASGI-сервера, а не поток: поток занят только пока
+# обработчик реально работает. Потоковые ответы (NDJSON-выгрузка)
+# отдаются по кусочку — поток берётся на чтение очередной порции и
+# сразу освобождается.
+#
+#     uvicorn asgi:app --workers 4
+# ======================================================================
+
+ASGI_THREADS = int(os.environ.get("BCL_ASGI_THREADS", "16"))
+MAX_BODY_SIZE = int(os.environ.get("BCL_MAX_BODY_SIZE", str(16 * 1024 * 1024)))
+
+_END = object()
+
+
+class WSGIBridge:
+    """ASGI-приложение поверх WSGI-приложения с ограниченным пулом потоков."""
+
+    def __init__(self, wsgi_app, threads=ASGI_THREADS, on_startup=None, on_shutdown=None):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="asgi-db")
+        self.on_startup = on_startup
+        self.on_shutdown = on_shutdown
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+
+    # ------------------------------------------------------------------
+    async def _lifespan(self, receive, send):
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                # Сервер начнёт принимать соединения только после прогрева
+                if self.on_startup is not None:
+                    await loop.run_in_executor(self.executor, self.on_startup)
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self.on_shutdown is not None:
+                    await loop.run_in_executor(self.executor, self.on_shutdown)
+                self.executor.shutdown(wait=True)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _read_body(self, receive):
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return None
+            body = message.get("body", b"")
+            size += len(body)
+            if size > MAX_BODY_SIZE:
+                return False
+            chunks.append(body)
+            if not message.get("more_body"):
+                return b"".join(chunks)
+
+    async def _http(self, scope, receive, send):
+        body = await self._read_body(receive)
+        if body is None:
+            return
+        if body is False:
+            await _send_simple(send, 413, b'{"error":"request body too large"}')
+            return
+
+        environ = _environ(scope, body)
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started["status"] = int(status.split(" ", 1)[0])
+            started["headers"] = headers
+            return _no_write
+
+        def call():
+            result = self.wsgi_app(environ, start_response)
+            iterator = iter(result)
+            chunk = next(iterator, _END)
+            # Обычный ответ уже целиком в памяти (есть Content-Length) —
+            # дочитываем его в этом же потоке, без лишних переключений
+            if chunk is not _END and _has_length(started["headers"]):
+                chunk = b"".join([chunk, *iterator])
+                return result, iter(()), chunk
+            return result, iterator, chunk
+
+        loop = asyncio.get_running_loop()
+        result, iterator, chunk = await loop.run_in_executor(self.executor, call)
+
+        disconnected = asyncio.Event()
+        watcher = asyncio.ensure_future(_watch_disconnect(receive, disconnected))
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": started["status"],
+                "headers": [
+                    (name.lower().encode("latin-1"), value.encode("latin-1"))
+                    for name, value in started["headers"]
+                ],
+            })
+            while chunk is not _END and not disconnected.is_set():
+                if chunk:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                chunk = await loop.run_in_executor(self.executor, next, iterator, _END)
+            if not disconnected.is_set():
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            watcher.cancel()
+            close = getattr(result, "close", None)
+            if close is not None:
+                await loop.run_in_executor(self.executor, close)
+
+
+def _no_write(data):
+    raise RuntimeError("write() callable is not supported")
+
+
+def _has_length(headers):
+    return any(name.lower() == "content-length" for name, _ in headers)
+
+
+async def _watch_disconnect(receive, event):
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            event.set()
+            return
+
+
+async def _send_simple(send, status, body):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def _environ(scope, body):
+    """WSGI environ из ASGI scope (PEP 3333)."""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for raw_name, raw_value in scope.get("headers", []):
+        name = raw_name.decode("latin-1").upper().replace("-", "_")
+        value = raw_value.decode("latin-1")
+        if name == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+            continue
+        if name == "CONTENT_LENGTH":
+            continue
+        key = f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
@@ -0,0 +1,131 @@
+import json
+import threading
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен: без него работает стандартный json
+    orjson = None
+
+
+# ======================================================================
+# Отображение строк SQLite в JSON-словари.
+#
+# Спецификация — кортеж полей (json_key, колонки-кандидаты, default, convert).
+# Маппер компилируется один раз на набор колонок курсора: для каждого
+# поля заранее вычисляется индекс колонки, поэтому на строку приходится
+# только индексирование, без row.keys() и поиска по списку имён.
+# ======================================================================
+
+def field(key, columns=None, default=None, convert=None):
+    if columns is None:
+        columns = (key,)
+    elif isinstance(columns, str):
+        columns = (columns,)
+    return (key, columns, default, convert)
+
+
+_mapper_cache = {}
+_mapper_lock = threading.Lock()
+
+
+def compile_mapper(columns, spec):
+    """
+    columns — имена колонок курсора (cursor.description или row.keys()).
+    Возвращает функцию row -> dict. Результат кешируется.
+    """
+    columns = tuple(columns)
+    cache_key = (columns, spec)
+    mapper = _mapper_cache.get(cache_key)
+    if mapper is not None:
+        return mapper
+
+    index = {name: i for i, name in enumerate(columns)}
+    plan = []
+    for key, candidates, default, convert in spec:
+        pos = next((index[c] for c in candidates if c in index), None)
+        plan.append((key, pos, default, convert))
+
+    present = [(k, p) for k, p, d, c in plan if p is not None and c is None]
+    computed = [(k, p, d, c) for k, p, d, c in plan if p is None or c is not None]
+
+    def mapper(row):
+        item = {k: row[p] for k, p in present}
+        for k, p, d, c in computed:
+            value = d if p is None else row[p]
+            item[k] = c(value) if c is not None else value
+        return item
+
+    with _mapper_lock:
+        if len(_mapper_cache) > 256:
+            _mapper_cache.clear()
+        _mapper_cache[cache_key] = mapper
+    return mapper
+
+
+def cursor_columns(cursor):
+    return [d[0] for d in cursor.description]
+
+
+def map_rows(rows, spec, columns=None):
+    """Отображает список строк, компилируя маппер один раз на весь список."""
+    if not rows:
+        return []
+    mapper = compile_mapper(columns or rows[0].keys(), spec)
+    return [mapper(r) for r in rows]
+
+
+def map_row(row, spec):
+    if row is None:
+        return None
+    return compile_mapper(row.keys(), spec)(row)
+
+
+def fetch_dicts(cursor):
+    """Все строки курсора как словари; имена колонок берутся один раз."""
+    columns = cursor_columns(cursor)
+    return [dict(zip(columns, r)) for r in cursor.fetchall()]
+
+
+def fetch_dict(cursor):
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return dict(zip(cursor_columns(cursor), row))
+
+
+# ======================================================================
+# Быстрое JSON-кодирование.
+# ======================================================================
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+
+
+def dumps_bytes(obj, default=None):
+    """JSON сразу в bytes (orjson, если установлен)."""
+    default = default or DefaultJSONProvider.default
+    if orjson is not None:
+        return orjson.dumps(obj, default=default, option=_ORJSON_OPTIONS)
+    return json.dumps(obj, default=default, ensure_ascii=False, sort_keys=True).encode("utf-8")
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    JSON-провайдер Flask на orjson: jsonify() кодирует ответ сразу в bytes.
+    Без orjson поведение совпадает со стандартным провайдером.
+    """
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return dumps_bytes(obj, self.default).decode("utf-8")
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            dumps_bytes(obj, self.default), mimetype=self.mimetype
+        )
@@ -1,9 +1,16 @@
 import os
 import sys
 import base64
+import hashlib
+import math
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
 from functools import wraps
 
-from flask import Flask, request, jsonify, Response
+from flask import Flask, g, request, jsonify, Response, make_response
+from werkzeug.http import http_date, parse_date
 
 # --- Добавляем корень проекта в PYTHONPATH ---
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -11,12 +18,55 @@ project_root = os.path.dirname(current_dir)
 if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
-from database.connection import get_connection, init_db
-from utils.hashing import hash_password, verify_password
+from database.connection import (
+    DB_PATH,
+    close_pool,
+    configure_connection,
+    get_connection,
+    get_pool,
+    init_db,
+    init_lock,
+    pool_stats,
+    pooled_connection,
+    start_db_timer,
+    stop_db_timer,
+)
+from database.migrations import VERSIONED_TABLES
+from database.writer import get_writer, run_write, stop_writer, writer_stats
+from api.serialization import (
+    FastJSONProvider,
+    compile_mapper,
+    cursor_columns,
+    dumps_bytes,
+    fetch_dict,
+    fetch_dicts,
+    field,
+    map_row,
+    map_rows,
+)
+from utils import metrics
+from utils.cache import TTLCache
+from utils.events import ChangeNotifier
+from utils.ratelimit import (
+    EXPENSIVE_CONCURRENCY,
+    RATE_LIMIT_ENABLED,
+    RATE_LIMITS,
+    ConcurrencyLimit,
+    TokenBucketLimiter,
+)
+from utils.hashing import (
+    HashingBusy,
+    dummy_hash,
+    get_hashing_pool,
+    hash_password,
+    needs_rehash,
+)
+from utils.tokens import ENV_SECRET, issue_token, revoke_jti, revoke_token, set_secret, verify_token
 from utils.validation import is_valid_email, not_empty
 
 # --- Flask-приложение ---
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 
 # --- Basic Auth (Session 3) ---
 BASIC_USER = "staff"
@@ -38,32 +88,280 @@ def _check_basic_auth():
     return username == BASIC_USER and password == BASIC_PASS
 
 
+# --- Контроль допуска: лимиты частоты и «дорогих» запросов ---
+rate_limiter = TokenBucketLimiter(RATE_LIMITS)
+expensive_requests = ConcurrencyLimit(EXPENSIVE_CONCURRENCY)
+TRUST_PROXY = os.environ.get("BCL_TRUST_PROXY") == "1"
+
+
+def rate_limit(route_class):
+    """
+    Класс лимита маршрута (см. utils.ratelimit.DEFAULT_LIMITS и BCL_RATE_LIMITS).
+    Ставится под @require_auth:
+
+        @app.get("/api/orders")
+        @require_auth
+        @rate_limit("reporting")
+        def list_orders(): ...
+
+    Лимит «дорогого» класса расходуют только дорогие запросы
+    (_is_expensive_request); остальные запросы маршрута идут по "default".
+    Под @conditional дорогой запрос допускается уже после проверки
+    ETag, так что ответ 304 лимит отчётов не расходует.
+    """
+    def decorator(fn):
+        fn.rate_class = route_class
+        return fn
+
+    return decorator
+
+
+def _client_id():
+    if TRUST_PROXY:
+        forwarded = request.headers.get("X-Forwarded-For", "")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.remote_addr or "unknown"
+
+
+def _is_expensive_request():
+    """Полный список без пагинации или потоковая выгрузка."""
+    if "ids" in request.args:
+        # Выборка по списку id ограничена MULTI_GET_MAX_IDS
+        return False
+    return "limit" not in request.args or stream_format() is not None
+
+
+def _too_many(reason, retry_after):
+    REJECTED.inc(_route_label(), reason)
+    resp = jsonify({"error": "too many requests", "reason": reason})
+    resp.status_code = 429
+    resp.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return resp
+
+
+def _admit(route_class, fn, args, kwargs):
+    expensive = RATE_LIMITS.get(route_class, RATE_LIMITS["default"])[2]
+    wait = rate_limiter.acquire(_client_id(), "default" if expensive else route_class)
+    if wait:
+        return _too_many("rate_limit", wait)
+
+    if not (expensive and _is_expensive_request()):
+        return fn(*args, **kwargs)
+
+    g.expensive_class = route_class
+    if not getattr(fn, "admits_expensive", False):
+        rejected = admit_expensive()
+        if rejected is not None:
+            return rejected
+    try:
+        resp = make_response(fn(*args, **kwargs))
+    except BaseException:
+        if g.pop("expensive_slot", False):
+            expensive_requests.release()
+        raise
+    if g.pop("expensive_slot", False):
+        # Слот освобождается, когда ответ отдан целиком (важно для выгрузок)
+        resp.call_on_close(expensive_requests.release)
+    return resp
+
+
+def admit_expensive():
+    """
+    Допуск дорогого запроса: токен его класса и слот EXPENSIVE_CONCURRENCY.
+    Возвращает ответ 429 или None. Вне дорогого запроса ничего не делает.
+    """
+    route_class = g.pop("expensive_class", None)
+    if route_class is None:
+        return None
+    wait = rate_limiter.acquire(_client_id(), route_class)
+    if wait:
+        return _too_many("rate_limit", wait)
+    if not expensive_requests.try_acquire():
+        return _too_many("concurrency", 1)
+    g.expensive_slot = True
+    return None
+
+
 def require_auth(fn):
+    route_class = getattr(fn, "rate_class", "default")
+
     @wraps(fn)
     def wrapper(*args, **kwargs):
         # Можно пропускать preflight / OPTIONS
         if request.method == "OPTIONS":
             return fn(*args, **kwargs)
 
-        if not _check_basic_auth():
+        started = time.perf_counter()
+        allowed = _check_basic_auth()
+        g.auth_time = time.perf_counter() - started
+        if not allowed:
             return Response(
                 "Unauthorized",
                 status=401,
                 headers={"WWW-Authenticate": 'Basic realm="BCL API"'},
             )
+        if RATE_LIMIT_ENABLED:
+            return _admit(route_class, fn, args, kwargs)
+        return fn(*args, **kwargs)
+
+    return wrapper
+
+
+# --- Сессии пользователей (Session 4): токен из /api/login ---
+def _bearer_token():
+    auth_header = request.headers.get("Authorization", "")
+    if not auth_header.startswith("Bearer "):
+        return None
+    return auth_header.split(" ", 1)[1].strip()
+
+
+# Как часто воркер подгружает отзывы токенов, сделанные другими процессами, сек
+REVOKED_SYNC_INTERVAL = float(os.environ.get("BCL_REVOKED_SYNC_INTERVAL", "1"))
+
+_revoked_sync = {"at": 0.0, "last_id": 0}
+_revoked_sync_lock = threading.Lock()
+
+
+# Файл секрета рядом с базой (не в самой базе: bcl_app.sqlite лежит в git)
+SESSION_SECRET_PATH = DB_PATH + ".secret"
+
+
+def load_session_secret():
+    """
+    Без BCL_SESSION_SECRET токены подписываются секретом из файла
+    SESSION_SECRET_PATH (права 0600): его создаёт первый процесс под
+    init_lock, остальные воркеры (и перезапуски) читают тот же.
+    """
+    if ENV_SECRET:
+        return
+    with init_lock():
+        try:
+            with open(SESSION_SECRET_PATH, "rb") as f:
+                secret = f.read()
+        except FileNotFoundError:
+            secret = b""
+        if len(secret) < 32:
+            secret = os.urandom(32)
+            flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+            fd = os.open(SESSION_SECRET_PATH, flags, 0o600)
+            with os.fdopen(fd, "wb") as f:
+                f.write(secret)
+    set_secret(secret)
+
+
+def sync_revoked_tokens():
+    """
+    Переносит в кеш отзывов процесса новые строки revoked_tokens
+    (logout в других воркерах) — не чаще раза в REVOKED_SYNC_INTERVAL.
+    Пока один поток читает таблицу, остальные проверяют по кешу.
+    """
+    if time.monotonic() - _revoked_sync["at"] < REVOKED_SYNC_INTERVAL:
+        return
+    if not _revoked_sync_lock.acquire(blocking=False):
+        return
+    try:
+        with pooled_connection() as conn:
+            rows = conn.execute(
+                "SELECT id, jti, expires_at FROM revoked_tokens WHERE id > ? ORDER BY id",
+                (_revoked_sync["last_id"],),
+            ).fetchall()
+        for r in rows:
+            revoke_jti(r["jti"], r["expires_at"])
+            _revoked_sync["last_id"] = r["id"]
+        _revoked_sync["at"] = time.monotonic()
+    finally:
+        _revoked_sync_lock.release()
+
+
+def require_user(fn):
+    """
+    Проверяет токен "Authorization: Bearer <token>" по HMAC, без запроса
+    к users; отзывы из других воркеров подгружает sync_revoked_tokens().
+    id пользователя доступен обработчику как g.user_id.
+    """
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        sync_revoked_tokens()
+        claims = verify_token(_bearer_token())
+        g.auth_time = time.perf_counter() - started
+        if claims is None:
+            return Response(
+                "Unauthorized",
+                status=401,
+                headers={"WWW-Authenticate": 'Bearer realm="BCL API"'},
+            )
+        g.user_id = claims["sub"]
         return fn(*args, **kwargs)
 
     return wrapper
 
 
-# --- ИНИЦИАЛИЗАЦИЯ БАЗЫ ---
+# --- МЕТРИКИ ЗАПРОСОВ (/metrics) ---
+REQUEST_LATENCY = metrics.Histogram(
+    "bcl_http_request_duration_seconds",
+    "Request latency by route",
+    ("method", "route"),
+)
+REQUEST_STAGE = metrics.Histogram(
+    "bcl_http_request_stage_seconds",
+    "Request time by stage: db (SQLite in the request thread), "
+    "write_wait (db writer queue), auth, other (handler code, serialization)",
+    ("route", "stage"),
+)
+REQUESTS_TOTAL = metrics.Counter(
+    "bcl_http_requests_total", "Requests by route and status", ("method", "route", "status")
+)
+DB_QUERIES = metrics.Counter(
+    "bcl_db_queries_total", "SQLite statements executed in request threads", ("route",)
+)
+IN_FLIGHT = metrics.Gauge("bcl_http_requests_in_flight", "Requests being processed")
+REJECTED = metrics.Counter(
+    "bcl_http_rejected_total", "Requests rejected by admission control", ("route", "reason")
+)
+
+
+def _route_label():
+    rule = request.url_rule
+    return rule.rule if rule is not None else "unmatched"
 
 
 @app.before_request
-def setup_once():
-    if not hasattr(app, "_db_init_done"):
-        init_db()
-        app._db_init_done = True
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+    IN_FLIGHT.inc()
+    start_db_timer()
+
+
+@app.after_request
+def _remember_status(resp):
+    g.response_status = resp.status_code
+    return resp
+
+
+@app.teardown_request
+def _record_request(exc):
+    started = g.pop("request_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    IN_FLIGHT.dec()
+    db = stop_db_timer() or {"queries": 0, "time": 0.0, "write_wait": 0.0}
+
+    route = _route_label()
+    status = g.get("response_status", 500)
+    auth = g.get("auth_time", 0.0)
+    REQUEST_LATENCY.observe(elapsed, request.method, route)
+    REQUESTS_TOTAL.inc(request.method, route, status)
+    DB_QUERIES.inc(route, amount=db["queries"])
+    REQUEST_STAGE.observe(db["time"], route, "db")
+    REQUEST_STAGE.observe(db["write_wait"], route, "write_wait")
+    REQUEST_STAGE.observe(auth, route, "auth")
+    REQUEST_STAGE.observe(max(0.0, elapsed - db["time"] - db["write_wait"] - auth), route, "other")
+
+
+# --- ИНИЦИАЛИЗАЦИЯ БАЗЫ: см. create_app() / warm_up() в конце модуля ---
 
 
 # ======================================================================
@@ -86,27 +384,30 @@ def register():
     if not password or len(password) < 6:
         return jsonify({"error": "Password too short"}), 400
 
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT id FROM users WHERE email = ?", (email,))
-    if cur.fetchone():
-        conn.close()
-        return jsonify({"error": "User exists"}), 400
+    # Хеширование — в пуле и до постановки в очередь, чтобы не задерживать писателя
+    hashing = get_hashing_pool()
+    pwd_hash = hashing.hash(password)
+    sec_hash = hashing.hash(secret_answer) if secret_answer else None
 
-    pwd_hash = hash_password(password)
-    sec_hash = hash_password(secret_answer) if secret_answer else None
+    def _job(conn):
+        cur = conn.cursor()
+        cur.execute("SELECT id FROM users WHERE email = ?", (email,))
+        if cur.fetchone():
+            return None
 
-    cur.execute(
-        """
-        INSERT INTO users(email, password_hash, first_name, last_name,
-                          mailing_list, secret_question, secret_answer_hash)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        """,
-        (email, pwd_hash, first_name, last_name, mailing_list, secret_question, sec_hash),
-    )
-    conn.commit()
-    user_id = cur.lastrowid
-    conn.close()
+        cur.execute(
+            """
+            INSERT INTO users(email, password_hash, first_name, last_name,
+                              mailing_list, secret_question, secret_answer_hash)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (email, pwd_hash, first_name, last_name, mailing_list, secret_question, sec_hash),
+        )
+        return cur.lastrowid
+
+    user_id = run_write(_job)
+    if user_id is None:
+        return jsonify({"error": "User exists"}), 400
 
     return jsonify({"id": user_id, "email": email}), 201
 
@@ -117,50 +418,93 @@ def login():
     email = data.get("email", "")
     password = data.get("password", "")
 
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT id, password_hash FROM users WHERE email = ?", (email,))
-    row = cur.fetchone()
-    conn.close()
+    with pooled_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id, password_hash FROM users WHERE email = ?", (email,))
+        row = cur.fetchone()
 
-    if not row or not verify_password(password, row["password_hash"]):
+    # Для неизвестного email KDF тоже считается (по dummy_hash): иначе
+    # по времени ответа видно, зарегистрирован ли адрес
+    hashing = get_hashing_pool()
+    stored = row["password_hash"] if row else dummy_hash()
+    if not hashing.verify(password, stored) or not row:
         return jsonify({"error": "Invalid credentials"}), 401
 
-    return jsonify({"user_id": row["id"]})
+    if needs_rehash(row["password_hash"]):
+        # Хеш со старыми параметрами пересчитываем в фоне, ответ не ждёт
+        hashing.run_background(_upgrade_password_hash, row["id"], row["password_hash"], password)
+
+    token, expires_at = issue_token(row["id"])
+    return jsonify({"user_id": row["id"], "token": token, "expires_at": expires_at})
+
+
+def _upgrade_password_hash(user_id, old_hash, password):
+    """Выполняется в пуле хеширования (run_background)."""
+    new_hash = hash_password(password)
+
+    def _job(conn):
+        # Только если хеш не сменили параллельно (смена пароля, другой логин)
+        conn.execute(
+            "UPDATE users SET password_hash = ? WHERE id = ? AND password_hash = ?",
+            (new_hash, user_id, old_hash),
+        )
+
+    get_writer().submit(_job)
+
+
+@app.errorhandler(HashingBusy)
+def _hashing_busy(e):
+    resp = jsonify({"error": str(e)})
+    resp.status_code = 503
+    resp.headers["Retry-After"] = "1"
+    return resp
+
+
+@app.post("/api/logout")
+@require_user
+def logout():
+    claims = revoke_token(_bearer_token())
+    if claims is not None:
+        # Отзыв в БД — для остальных воркеров (sync_revoked_tokens)
+        def _job(conn):
+            conn.execute("DELETE FROM revoked_tokens WHERE expires_at <= ?", (time.time(),))
+            conn.execute(
+                "INSERT OR IGNORE INTO revoked_tokens(jti, expires_at) VALUES (?, ?)",
+                (claims["jti"], claims["exp"]),
+            )
+
+        run_write(_job)
+    return jsonify({"status": "ok"})
 
 
 @app.get("/api/profile")
+@require_user
 def profile():
-    user_id = request.args.get("user_id")
-    if not user_id:
-        return jsonify({"error": "user_id required"}), 400
+    user_id = g.user_id
 
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT id, email, first_name, last_name, phone, mailing_list,
-               preferred_delivery, profile_image
-        FROM users WHERE id = ?
-        """,
-        (user_id,),
-    )
-    row = cur.fetchone()
-    conn.close()
+    with pooled_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT id, email, first_name, last_name, phone, mailing_list,
+                   preferred_delivery, profile_image
+            FROM users WHERE id = ?
+            """,
+            (user_id,),
+        )
+        user = fetch_dict(cur)
 
-    if not row:
+    if not user:
         return jsonify({"error": "User not found"}), 404
 
-    return jsonify(dict(row))
+    return jsonify(user)
 
 
 @app.put("/api/profile")
+@require_user
 def update_profile():
     data = request.json or {}
-    user_id = data.get("id")
-
-    if not user_id:
-        return jsonify({"error": "id required"}), 400
+    user_id = g.user_id
 
     fields = [
         "first_name",
@@ -184,11 +528,10 @@ def update_profile():
 
     values.append(user_id)
 
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(f"UPDATE users SET {', '.join(updates)} WHERE id = ?", values)
-    conn.commit()
-    conn.close()
+    def _job(conn):
+        conn.execute(f"UPDATE users SET {', '.join(updates)} WHERE id = ?", values)
+
+    run_write(_job)
 
     return jsonify({"status": "ok"})
 
@@ -197,253 +540,1105 @@ def update_profile():
 # =====================  HELPERS: PRODUCTS / ORDERS  ===================
 # ======================================================================
 
-def row_get(row, key, default=None):
-    """Безопасное получение поля из sqlite3.Row (без .get())."""
-    keys = row.keys()
-    if key in keys:
-        return row[key]
-    return default
+# Спецификации маппинга строк в JSON: (поле, колонки-кандидаты, default, convert).
+# Default подставляется, только если колонки нет в выборке.
+PRODUCT_ROW = (
+    field("id"),
+    field("product_id"),
+    field("name", ("product_name", "name")),
+    field("category"),
+    field("price"),
+    field("cost"),
+    field("description", ("ingredients", "description")),
+    field("seasonal", default=0, convert=bool),
+    field("active", default=1, convert=bool),
+    field("introduced_date"),
+    field("stock", default=0),
+)
+
+CUSTOMER_ROW = (
+    field("id"),
+    field("customer_id"),
+    field("name"),
+    field("gender"),
+    field("age"),
+    field("loyalty_status", ("loyalty_status", "membership")),
+    field("total_spent", ("total_spent", "total_spending")),
+    field("churn_status"),
+)
 
 
 def row_to_product(row):
+    """Преобразует строку products в JSON-формат API Session 3."""
+    return map_row(row, PRODUCT_ROW)
+
+
+# ======================================================================
+# ========================  HELPERS: LIST QUERIES  =====================
+# ======================================================================
+
+DEFAULT_PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 1000
+MULTI_GET_MAX_IDS = int(os.environ.get("BCL_MULTI_GET_MAX_IDS", "1000"))
+
+
+class BadRequest(Exception):
+    """Некорректные параметры запроса -> 400."""
+
+
+@app.errorhandler(BadRequest)
+def _bad_request(e):
+    return jsonify({"error": str(e)}), 400
+
+
+def _int_arg(name, default=None, minimum=None, maximum=None):
+    raw = request.args.get(name)
+    if raw is None or raw == "":
+        return default
+    try:
+        value = int(raw)
+    except ValueError:
+        raise BadRequest(f"{name} must be an integer")
+    if minimum is not None and value < minimum:
+        raise BadRequest(f"{name} must be >= {minimum}")
+    if maximum is not None and value > maximum:
+        value = maximum
+    return value
+
+
+def page_args():
     """
-    Преобразует строку products в JSON-формат API Session 3.
-    Ожидается схема:
-        id, product_id, product_name, category, ingredients,
-        price, cost, seasonal, active, introduced_date, stock
+    Keyset-пагинация: ?after_id=<последний id прошлой страницы>&limit=<N>&count=1.
+    Возвращает None, если клиент не запросил пагинацию (старый формат — весь список).
     """
+    if "after_id" not in request.args and "limit" not in request.args:
+        return None
     return {
-        "id": row["id"],
-        "product_id": row_get(row, "product_id"),
-        "name": row_get(row, "product_name"),
-        "category": row_get(row, "category"),
-        "price": row_get(row, "price"),
-        "cost": row_get(row, "cost"),
-        "description": row_get(row, "ingredients"),
-        "seasonal": bool(row_get(row, "seasonal", 0)),
-        "active": bool(row_get(row, "active", 1)),
-        "introduced_date": row_get(row, "introduced_date"),
-        "stock": row_get(row, "stock", 0),
+        "after_id": _int_arg("after_id", 0, minimum=0),
+        "limit": _int_arg("limit", DEFAULT_PAGE_LIMIT, minimum=1, maximum=MAX_PAGE_LIMIT),
+        "count": request.args.get("count") in ("1", "true", "yes"),
+    }
+
+
+def ids_arg(name="ids"):
+    """
+    Выборка по списку: ?ids=1,2,3. Возвращает id без повторов в порядке
+    запроса или None, если параметра нет.
+    """
+    raw = request.args.get(name)
+    if raw is None:
+        return None
+    try:
+        ids = [int(v) for v in raw.split(",") if v.strip()]
+    except ValueError:
+        raise BadRequest(f"{name} must be a comma-separated list of integers")
+    if not ids or any(i <= 0 for i in ids):
+        raise BadRequest(f"{name} must be a non-empty list of positive integers")
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > MULTI_GET_MAX_IDS:
+        raise BadRequest(f"at most {MULTI_GET_MAX_IDS} ids per request")
+    return ids
+
+
+def include_arg(allowed):
+    """?include=a,b — связанные данные, которые нужно вложить в ответ."""
+    raw = request.args.get("include") or ""
+    include = {v.strip() for v in raw.split(",") if v.strip()}
+    unknown = include - set(allowed)
+    if unknown:
+        raise BadRequest(f"cannot include: {', '.join(sorted(unknown))}")
+    return include
+
+
+_table_columns_cache = {}
+
+
+def table_columns(conn, table):
+    """Множество колонок таблицы (кешируется на процесс)."""
+    cols = _table_columns_cache.get(table)
+    if cols is None:
+        cols = {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+        _table_columns_cache[table] = cols
+    return cols
+
+
+def _resolve_field(candidates, columns):
+    """
+    Кандидат — имя колонки или (SQL-выражение, нужные колонки).
+    Возвращает SQL-выражение первого кандидата, который есть в таблице.
+    """
+    for cand in candidates:
+        if isinstance(cand, str):
+            if cand in columns:
+                return cand
+        else:
+            expr, required = cand
+            if all(c in columns for c in required):
+                return expr
+    return None
+
+
+def _truthy(value):
+    return str(value).lower() in ("1", "true", "yes")
+
+
+def list_args(spec):
+    """
+    Разбирает общие параметры списков: fields=, sort= и фильтры ресурса.
+    Возвращает dict с ключами fields, sort, desc, where, params.
+    """
+    fields = None
+    raw_fields = request.args.get("fields")
+    if raw_fields:
+        fields = [f.strip() for f in raw_fields.split(",") if f.strip()]
+        unknown = [f for f in fields if f not in spec["fields"]]
+        if unknown:
+            raise BadRequest(f"unknown fields: {', '.join(unknown)}")
+
+    sort = request.args.get("sort") or "id"
+    desc = sort.startswith("-")
+    sort = sort.lstrip("-+")
+    if sort not in spec["sort"]:
+        raise BadRequest(f"cannot sort by {sort}")
+
+    where = []
+    params = []
+    for name, (expr, convert) in spec["filters"].items():
+        raw = request.args.get(name)
+        if raw is None or raw == "":
+            continue
+        try:
+            value = convert(raw)
+        except ValueError:
+            raise BadRequest(f"invalid value for {name}")
+        where.append(expr)
+        params.append(value)
+
+    return {"fields": fields, "sort": sort, "desc": desc, "where": where, "params": params}
+
+
+def projection(conn, spec, fields=None):
+    """
+    Список SELECT только для нужных полей: «выражение AS алиас», где
+    алиас — каноническое имя колонки, которое читает маппер.
+    """
+    columns = table_columns(conn, spec["table"])
+    wanted = fields or list(spec["fields"])
+    if "id" not in wanted:
+        wanted = ["id"] + wanted
+
+    select = []
+    for name in wanted:
+        candidates = spec["fields"][name]
+        expr = _resolve_field(candidates, columns)
+        if expr is None:
+            continue
+        alias = candidates[0] if isinstance(candidates[0], str) else name
+        select.append(f"{expr} AS {alias}")
+    return ", ".join(select)
+
+
+def build_list_query(conn, spec, args, page=None):
+    """
+    Строит SELECT для списка: проекция только нужных колонок,
+    фильтры как параметризованные условия WHERE, ORDER BY <sort>, id.
+    При пагинации курсор after_id переводится в условие по ключу
+    сортировки: (sort, id) > (sort строки after_id, after_id), с явной
+    обработкой NULL (см. _cursor_condition).
+    Возвращает (sql, params, count_sql, count_params).
+    """
+    columns = table_columns(conn, spec["table"])
+    select = projection(conn, spec, args["fields"])
+
+    id_col = spec["id"]
+    if args["sort"] == "id":
+        sort_expr = id_col
+    else:
+        sort_expr = _resolve_field(spec["fields"][args["sort"]], columns)
+        if sort_expr is None:
+            raise BadRequest(f"cannot sort by {args['sort']}")
+    where = list(args["where"])
+    params = list(args["params"])
+
+    count_sql = f"SELECT COUNT(*) FROM {spec['from']}"
+    if where:
+        count_sql += " WHERE " + " AND ".join(where)
+    count_params = list(params)
+
+    direction = "DESC" if args["desc"] else "ASC"
+    if sort_expr == id_col:
+        order_by = f"{id_col} {direction}"
+    else:
+        order_by = f"{sort_expr} {direction}, {id_col} {direction}"
+
+    limit_sql = ""
+    if page is not None:
+        if page["after_id"]:
+            op = "<" if args["desc"] else ">"
+            if sort_expr == id_col:
+                where.append(f"{id_col} {op} ?")
+                params.append(page["after_id"])
+            else:
+                row = conn.execute(
+                    f"SELECT {sort_expr} FROM {spec['from']} WHERE {id_col} = ?",
+                    (page["after_id"],),
+                ).fetchone()
+                if row is None:
+                    # Строку курсора удалили — продолжить с неё нельзя
+                    where.append("0")
+                else:
+                    cond, cond_params = _cursor_condition(
+                        sort_expr, id_col, op, row[0], page["after_id"]
+                    )
+                    where.append(cond)
+                    params.extend(cond_params)
+        limit_sql = " LIMIT ?"
+        params.append(page["limit"] + 1)
+
+    sql = f"SELECT {select} FROM {spec['from']}"
+    if spec.get("join"):
+        sql += " " + spec["join"]
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" ORDER BY {order_by}{limit_sql}"
+    return sql, params, count_sql, count_params
+
+
+def _cursor_condition(sort_expr, id_col, op, value, after_id):
+    """
+    Условие «строка после курсора» для сортировки по (sort, id).
+    SQLite ставит NULL раньше любых значений: в начало при ASC и в конец
+    при DESC. Сравнение с NULL даёт NULL, поэтому такие строки проходят
+    отдельными ветками IS NULL, иначе они выпадали бы из выдачи.
+    """
+    asc = op == ">"
+    if value is None:
+        cond = f"({sort_expr} IS NULL AND {id_col} {op} ?)"
+        if asc:
+            cond = f"({cond} OR {sort_expr} IS NOT NULL)"
+        return cond, [after_id]
+
+    cond = f"({sort_expr}, {id_col}) {op} (?, ?)"
+    if not asc:
+        cond = f"({cond} OR {sort_expr} IS NULL)"
+    return cond, [value, after_id]
+
+
+def select_list(conn, spec, args, page=None):
+    """Выполняет запрос списка. Возвращает (rows, meta) — meta равно None без пагинации."""
+    sql, params, count_sql, count_params = build_list_query(conn, spec, args, page)
+    rows = conn.execute(sql, params).fetchall()
+    if page is None:
+        return rows, None
+
+    limit = page["limit"]
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    meta = {
+        "limit": limit,
+        "next_after_id": rows[-1]["id"] if has_more else None,
     }
+    if page["count"]:
+        meta["total"] = conn.execute(count_sql, count_params).fetchone()[0]
+    return rows, meta
+
+
+def select_multi(conn, spec, fields, ids):
+    """
+    Строки ресурса по списку id: проекция как у списка, один запрос
+    WHERE id IN (...) на порцию IN_CHUNK_SIZE вместо запроса на каждый id.
+    """
+    sql = f"SELECT {projection(conn, spec, fields)} FROM {spec['from']}"
+    if spec.get("join"):
+        sql += " " + spec["join"]
+    sql += f" WHERE {spec['id']} IN ({{ids}})"
+    return select_by_ids(conn, sql, ids)
+
+
+def multi_response(data, ids, fields=None):
+    """Ответ выборки по списку: строки в порядке ids и id, которых нет в БД."""
+    by_id = {d["id"]: d for d in data}
+    found = [by_id[i] for i in ids if i in by_id]
+    return page_response(
+        project(found, fields),
+        {"missing": [i for i in ids if i not in by_id]},
+    )
+
+
+def project(data, fields):
+    """Оставляет в ответе только запрошенные поля (fields=)."""
+    if not fields:
+        return data
+    return [{k: d[k] for k in fields if k in d} for d in data]
+
+
+# ======================================================================
+# ======================  HELPERS: CONDITIONAL GET  ====================
+# ======================================================================
+
+def table_versions(conn, tables):
+    """{таблица: (version, updated_at)} из table_versions (ведут триггеры)."""
+    marks = ", ".join("?" for _ in tables)
+    rows = conn.execute(
+        f"SELECT name, version, updated_at FROM table_versions WHERE name IN ({marks})",
+        list(tables),
+    ).fetchall()
+    return {r["name"]: (r["version"], r["updated_at"]) for r in rows}
+
+
+def conditional(*tables):
+    """
+    ETag / Last-Modified для GET по счётчикам изменений таблиц.
+    ETag зависит от версий таблиц и от URL запроса (фильтры, страница),
+    поэтому If-None-Match проверяется до чтения самих строк: при
+    совпадении сразу отдаём 304 без тела.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with pooled_connection() as conn:
+                versions = table_versions(conn, tables)
+            g.table_versions = versions
+
+            tag = ".".join(str(versions.get(t, (0, 0))[0]) for t in tables)
+            # Accept влияет на формат ответа (NDJSON или JSON), поэтому входит в ETag
+            variant = request.full_path + "|" + request.headers.get("Accept", "")
+            url_hash = zlib.crc32(variant.encode("utf-8"))
+            etag = f'W/"{tag}-{url_hash:08x}"'
+            updated = max((v[1] for v in versions.values()), default=0)
+            last_modified = datetime.fromtimestamp(int(updated), tz=timezone.utc)
+
+            if etag in request.headers.get("If-None-Match", ""):
+                return _not_modified(etag, last_modified)
+            # Last-Modified точен до секунды: пока идёт секунда последнего
+            # изменения, в ней возможна ещё запись, и по дате её не отличить
+            if "If-None-Match" not in request.headers and int(updated) < int(time.time()):
+                since = parse_date(request.headers.get("If-Modified-Since"))
+                if since is not None and last_modified <= since:
+                    return _not_modified(etag, last_modified)
+
+            rejected = admit_expensive()
+            if rejected is not None:
+                return rejected
+            resp = make_response(fn(*args, **kwargs))
+            if resp.status_code == 200:
+                resp.headers["ETag"] = etag
+                resp.headers["Last-Modified"] = http_date(last_modified)
+                resp.headers["Cache-Control"] = "no-cache"
+                resp.headers["Vary"] = "Accept"
+            return resp
+
+        # Дорогой запрос допускается внутри, после проверки ETag (см. _admit)
+        wrapper.admits_expensive = True
+        return wrapper
+
+    return decorator
+
+
+def _not_modified(etag, last_modified):
+    resp = Response(status=304)
+    resp.headers["ETag"] = etag
+    resp.headers["Last-Modified"] = http_date(last_modified)
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+
+def page_response(data, meta):
+    body = {"items": data}
+    body.update(meta)
+    return jsonify(body)
+
+
+# ======================================================================
+# ========================  HELPERS: STREAMING  ========================
+# ======================================================================
+
+STREAM_BATCH_SIZE = 500
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+
+def stream_format():
+    """
+    Потоковая выгрузка запрошена через Accept: application/x-ndjson,
+    ?stream=ndjson (NDJSON) или ?stream=1 (JSON-массив по частям).
+    Возвращает "ndjson", "json" или None.
+    """
+    stream = request.args.get("stream", "")
+    if stream == "ndjson" or NDJSON_MIMETYPE in request.headers.get("Accept", ""):
+        return "ndjson"
+    if _truthy(stream):
+        return "json"
+    return None
+
+
+def stream_list(spec, args, row_spec, fmt):
+    """
+    Отдаёт весь список (с фильтрами и сортировкой, без пагинации),
+    читая курсор пачками fetchmany и кодируя строки по мере чтения:
+    память не растёт с размером таблицы, первый байт уходит сразу.
+    Для выгрузки берётся отдельное соединение, чтобы долгий экспорт
+    не занимал соединение из общего пула.
+    """
+    fields = args["fields"]
+
+    def generate():
+        # Под ASGI (api/asgi.py) порции генератора читаются из разных
+        # потоков пула, но строго последовательно
+        conn = configure_connection(get_connection(check_same_thread=False))
+        try:
+            sql, params, _, _ = build_list_query(conn, spec, args)
+            cur = conn.execute(sql, params)
+            mapper = compile_mapper(cursor_columns(cur), row_spec)
+
+            def encode(row):
+                item = mapper(row)
+                if fields:
+                    item = {k: item[k] for k in fields if k in item}
+                return dumps_bytes(item)
+
+            first = True
+            if fmt == "json":
+                yield b"["
+            while True:
+                rows = cur.fetchmany(STREAM_BATCH_SIZE)
+                if not rows:
+                    break
+                if fmt == "ndjson":
+                    yield b"".join(encode(r) + b"\n" for r in rows)
+                else:
+                    chunk = b",".join(encode(r) for r in rows)
+                    yield chunk if first else b"," + chunk
+                    first = False
+            if fmt == "json":
+                yield b"]"
+        finally:
+            conn.close()
+
+    mimetype = NDJSON_MIMETYPE if fmt == "ndjson" else "application/json"
+    return Response(generate(), mimetype=mimetype)
+
+
+# ======================================================================
+# ========================  HELPERS: DELTA SYNC  =======================
+# ======================================================================
+
+def select_row_changes(conn, table, since, limit):
+    """Строки row_changes таблицы с версией > since: (rows, has_more)."""
+    rows = conn.execute(
+        """
+        SELECT row_id, version, deleted FROM row_changes
+        WHERE tbl = ? AND version > ?
+        ORDER BY version
+        LIMIT ?
+        """,
+        (table, since, limit + 1),
+    ).fetchall()
+    return rows[:limit], len(rows) > limit
+
+
+def changes_response(table, key, load_state):
+    """
+    GET /api/<ресурс>/changes?since=<version>&limit=<N>: строки, изменённые
+    после версии since (по row_changes, которую ведут триггеры).
+    load_state(conn, ids) возвращает текущее состояние изменённых строк.
+    Ответ: {"version", "changed", "deleted", "has_more"}; следующий запрос
+    клиент делает с since=version. При has_more изменений больше limit —
+    нужно сразу запросить следующую порцию.
+    """
+    since = _int_arg("since", 0, minimum=0)
+    limit = _int_arg("limit", MAX_PAGE_LIMIT, minimum=1, maximum=MAX_PAGE_LIMIT)
+
+    with pooled_connection() as conn:
+        rows, has_more = select_row_changes(conn, table, since, limit)
+        changed_ids = [r["row_id"] for r in rows if not r["deleted"]]
+        changed = load_state(conn, changed_ids) if changed_ids else []
+
+    # Строку могли удалить между чтениями: для клиента она уже удалена
+    present = {item[key] for item in changed}
+    deleted = [r["row_id"] for r in rows if r["deleted"] or r["row_id"] not in present]
+
+    return jsonify({
+        "since": since,
+        "version": rows[-1]["version"] if rows else since,
+        "changed": changed,
+        "deleted": deleted,
+        "has_more": has_more,
+    })
 
 
 # ======================================================================
 # =========================  PRODUCTS (Session 3)  =====================
 # ======================================================================
 
+# Кеш каталога: ("item", id) -> dict продукта, ("list", URL) -> готовые байты JSON
+PRODUCT_CACHE_SIZE = int(os.environ.get("BCL_PRODUCT_CACHE_SIZE", "2048"))
+PRODUCT_CACHE_TTL = float(os.environ.get("BCL_PRODUCT_CACHE_TTL", "300"))
+product_cache = TTLCache(maxsize=PRODUCT_CACHE_SIZE, ttl=PRODUCT_CACHE_TTL)
+
+
+_product_cache_version = None
+
+
+def sync_product_cache(version):
+    """
+    При нескольких воркерах запись может пройти в другом процессе, и его
+    invalidate_products() наш кеш не увидит. Поэтому перед чтением кеша
+    сверяем счётчик изменений products (его уже прочитал @conditional)
+    и сбрасываем кеш, если таблица менялась.
+    """
+    global _product_cache_version
+    if version != _product_cache_version:
+        if _product_cache_version is not None:
+            product_cache.invalidate()
+        _product_cache_version = version
+
+
+def invalidate_products(pids=None):
+    """
+    Вызывается после успешной записи: сбрасывает все закешированные
+    списки и карточки указанных продуктов (pids=None — весь кеш).
+    """
+    if pids is None:
+        product_cache.invalidate()
+        return
+    pids = set(pids)
+    product_cache.invalidate(lambda key: key[0] == "list" or key[1] in pids)
+
+
+# JSON-поле -> кандидаты колонок (первая существующая; её имя — алиас для маппера)
+PRODUCT_LIST = {
+    "table": "products",
+    "from": "products",
+    "id": "id",
+    "fields": {
+        "id": ("id",),
+        "product_id": ("product_id",),
+        "name": ("product_name", "name"),
+        "category": ("category",),
+        "price": ("price",),
+        "cost": ("cost",),
+        "description": ("ingredients", "description"),
+        "seasonal": ("seasonal",),
+        "active": ("active",),
+        "introduced_date": ("introduced_date",),
+        "stock": ("stock",),
+    },
+    "sort": ["id", "name", "category", "price", "cost", "stock", "introduced_date"],
+    # параметр запроса -> (условие WHERE, преобразование значения)
+    "filters": {
+        "category": ("category = ?", str),
+        "active": ("active = ?", lambda v: 1 if _truthy(v) else 0),
+        "min_price": ("price >= ?", float),
+        "max_price": ("price <= ?", float),
+    },
+}
+
 @app.get("/api/products")
 @require_auth
+@rate_limit("reporting")
+@conditional("products")
 def list_products():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM products")
-    rows = cur.fetchall()
-    conn.close()
+    """
+    Фильтры: ?category=&active=0|1&min_price=&max_price=
+    Общие параметры: sort=<поле>|-<поле>, fields=a,b,c, after_id=, limit=, count=1
+    Выборка по списку: ?ids=1,2,3 -> {"items": [...], "missing": [...]}
+    """
+    ids = ids_arg()
+    if ids is not None:
+        sync_product_cache(g.table_versions["products"][0])
+        return multi_response(cached_products(ids), ids, list_args(PRODUCT_LIST)["fields"])
 
-    data = [row_to_product(r) for r in rows]
-    return jsonify(data)
+    fmt = stream_format()
+    if fmt is not None:
+        return stream_list(PRODUCT_LIST, list_args(PRODUCT_LIST), PRODUCT_ROW, fmt)
+
+    sync_product_cache(g.table_versions["products"][0])
+    return Response(product_list_body(), mimetype="application/json")
+
+
+def cached_products(ids):
+    """
+    Карточки продуктов по списку id: сначала из кеша ("item", id),
+    недостающие — одним запросом IN (...) на порцию, с записью в кеш.
+    """
+    products = []
+    missing = []
+    for pid in ids:
+        product = product_cache.get(("item", pid))
+        if product is None:
+            missing.append(pid)
+        else:
+            products.append(product)
+
+    if missing:
+        generation = product_cache.generation
+        with pooled_connection() as conn:
+            rows = select_by_ids(conn, "SELECT * FROM products WHERE id IN ({ids})", missing)
+        for product in map_rows(rows, PRODUCT_ROW):
+            product_cache.set(("item", product["id"]), product, generation)
+            products.append(product)
+    return products
+
+
+def product_list_body():
+    """Готовые байты JSON списка продуктов для текущего URL (через кеш)."""
+    key = ("list", request.full_path)
+    body = product_cache.get(key)
+    if body is None:
+        generation = product_cache.generation
+        page = page_args()
+        args = list_args(PRODUCT_LIST)
+        with pooled_connection() as conn:
+            rows, meta = select_list(conn, PRODUCT_LIST, args, page)
+
+        data = project(map_rows(rows, PRODUCT_ROW), args["fields"])
+        resp = page_response(data, meta) if page is not None else jsonify(data)
+        body = resp.get_data()
+        product_cache.set(key, body, generation)
+    return body
 
 
 @app.get("/api/products/<int:pid>")
 @require_auth
+@conditional("products")
 def get_product(pid):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM products WHERE id = ?", (pid,))
-    row = cur.fetchone()
-    conn.close()
+    sync_product_cache(g.table_versions["products"][0])
+    product = product_cache.get(("item", pid))
+    if product is None:
+        generation = product_cache.generation
+        with pooled_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT * FROM products WHERE id = ?", (pid,))
+            row = cur.fetchone()
 
-    if not row:
-        return jsonify({"error": "not found"}), 404
+        if not row:
+            return jsonify({"error": "not found"}), 404
 
-    return jsonify(row_to_product(row))
+        product = row_to_product(row)
+        product_cache.set(("item", pid), product, generation)
 
+    return jsonify(product)
 
-@app.post("/api/products")
+
+@app.get("/api/products/changes")
 @require_auth
-def create_product():
-    data = request.json or {}
+@conditional("products")
+def product_changes():
+    return changes_response(
+        "products", "id",
+        lambda conn, ids: map_rows(select_multi(conn, PRODUCT_LIST, None, ids), PRODUCT_ROW),
+    )
+
+
+def validate_product(data):
+    """
+    Валидации как в Session 3. Возвращает словарь полей продукта
+    или выбрасывает BadRequest с текстом ошибки.
+    """
     name = (data.get("name") or "").strip()
     category = (data.get("category") or "").strip()
-    price = data.get("price")
-    cost = data.get("cost")
-    description = (data.get("description") or "").strip()
-    seasonal = bool(data.get("seasonal"))
-    active = bool(data.get("active", True))
     introduced_date = (data.get("introduced_date") or "").strip()
 
-    # Валидации как в Session 3
     if not name or len(name) > 100:
-        return jsonify({"error": "ProductName is required and must be <= 100 chars"}), 400
+        raise BadRequest("ProductName is required and must be <= 100 chars")
     if not category:
-        return jsonify({"error": "Category is required"}), 400
+        raise BadRequest("Category is required")
 
     try:
-        price = float(price)
-        cost = float(cost)
+        price = float(data.get("price"))
+        cost = float(data.get("cost"))
     except (TypeError, ValueError):
-        return jsonify({"error": "Price and Cost must be numeric"}), 400
+        raise BadRequest("Price and Cost must be numeric")
 
     if price <= 0:
-        return jsonify({"error": "Price must be positive"}), 400
+        raise BadRequest("Price must be positive")
     if cost <= 0 or cost >= price:
-        return jsonify({"error": "Cost must be positive and less than Price"}), 400
+        raise BadRequest("Cost must be positive and less than Price")
     if not introduced_date:
-        return jsonify({"error": "IntroducedDate is required"}), 400
+        raise BadRequest("IntroducedDate is required")
 
-    stock = int(data.get("stock", 50))
+    try:
+        stock = int(data.get("stock", 50))
+    except (TypeError, ValueError):
+        raise BadRequest("Stock must be an integer")
+    if stock < 0:
+        raise BadRequest("Stock must not be negative")
 
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO products(product_id, product_name, category,
-                             ingredients, price, cost, seasonal,
-                             active, introduced_date, stock)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-        (
-            data.get("product_id"),
-            name,
-            category,
-            description,
-            price,
-            cost,
-            1 if seasonal else 0,
-            1 if active else 0,
-            introduced_date,
-            stock,
-        ),
-    )
-    conn.commit()
-    new_id = cur.lastrowid
-    cur.execute("SELECT * FROM products WHERE id = ?", (new_id,))
-    row = cur.fetchone()
-    conn.close()
+    return {
+        "name": name,
+        "category": category,
+        "price": price,
+        "cost": cost,
+        "description": (data.get("description") or "").strip(),
+        "seasonal": 1 if data.get("seasonal") else 0,
+        "active": 1 if data.get("active", True) else 0,
+        "introduced_date": introduced_date,
+        "stock": stock,
+    }
 
-    return jsonify(row_to_product(row)), 201
 
+def product_columns(conn):
+    """JSON-поле продукта -> колонка текущей схемы (None, если колонки нет)."""
+    columns = table_columns(conn, "products")
+    return {f: _resolve_field(c, columns) for f, c in PRODUCT_LIST["fields"].items()}
 
-@app.put("/api/products/<int:pid>")
+
+@app.post("/api/products")
 @require_auth
-def update_product(pid):
+def create_product():
     data = request.json or {}
+    values = validate_product(data)
+    if data.get("product_id") is not None:
+        values["product_id"] = data["product_id"]
+
+    def _job(conn):
+        names = product_columns(conn)
+        fields = [f for f in values if names[f]]
+        cur = conn.cursor()
+        cur.execute(
+            f"INSERT INTO products({', '.join(names[f] for f in fields)}) "
+            f"VALUES ({', '.join('?' for _ in fields)})",
+            [values[f] for f in fields],
+        )
+        cur.execute("SELECT * FROM products WHERE id = ?", (cur.lastrowid,))
+        return row_to_product(cur.fetchone())
 
-    # Раскладка: JSON-поля -> колонки
-    mapping = {
-        "name": "product_name",
-        "category": "category",
-        "price": "price",
-        "cost": "cost",
-        "description": "ingredients",
-        "seasonal": "seasonal",
-        "active": "active",
-        "introduced_date": "introduced_date",
-        "stock": "stock",
-    }
+    product = run_write(_job)
+    invalidate_products([product["id"]])
+    return jsonify(product), 201
 
-    updates = []
-    values = []
 
-    for json_field, col_name in mapping.items():
+PRODUCT_UPDATABLE = [
+    "name", "category", "price", "cost", "description",
+    "seasonal", "active", "introduced_date", "stock",
+]
+
+
+@app.put("/api/products/<int:pid>")
+@require_auth
+def update_product(pid):
+    data = request.json or {}
+
+    # JSON-поля, которые можно менять; колонки берутся из PRODUCT_LIST
+    changes = {}
+    for json_field in PRODUCT_UPDATABLE:
         if json_field in data:
             val = data[json_field]
             if json_field in ("seasonal", "active"):
                 val = 1 if bool(val) else 0
-            updates.append(f"{col_name} = ?")
-            values.append(val)
+            changes[json_field] = val
 
-    if not updates:
+    if not changes:
         return jsonify({"error": "nothing to update"}), 400
 
-    values.append(pid)
+    def _job(conn):
+        names = product_columns(conn)
+        fields = [f for f in changes if names[f]]
+        if not fields:
+            return None
+        cur = conn.cursor()
+        cur.execute(
+            f"UPDATE products SET {', '.join(f'{names[f]} = ?' for f in fields)} WHERE id = ?",
+            [changes[f] for f in fields] + [pid],
+        )
+        if cur.rowcount == 0:
+            return None
+
+        cur.execute("SELECT * FROM products WHERE id = ?", (pid,))
+        return row_to_product(cur.fetchone())
 
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT id FROM products WHERE id = ?", (pid,))
-    if not cur.fetchone():
-        conn.close()
+    product = run_write(_job)
+    if product is None:
         return jsonify({"error": "not found"}), 404
 
-    cur.execute(f"UPDATE products SET {', '.join(updates)} WHERE id = ?", values)
-    conn.commit()
-
-    cur.execute("SELECT * FROM products WHERE id = ?", (pid,))
-    row = cur.fetchone()
-    conn.close()
-
-    return jsonify(row_to_product(row))
+    invalidate_products([pid])
+    return jsonify(product)
 
 
 @app.delete("/api/products/<int:pid>")
 @require_auth
 def delete_product(pid):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT id FROM products WHERE id = ?", (pid,))
-    if not cur.fetchone():
-        conn.close()
-        return jsonify({"error": "not found"}), 404
+    def _job(conn):
+        return conn.execute("DELETE FROM products WHERE id = ?", (pid,)).rowcount
 
-    cur.execute("DELETE FROM products WHERE id = ?", (pid,))
-    conn.commit()
-    conn.close()
+    if not run_write(_job):
+        return jsonify({"error": "not found"}), 404
+    invalidate_products([pid])
     return jsonify({"status": "deleted"})
 
 
+# ----------------------- BULK -----------------------
+
+BULK_MAX_ITEMS = int(os.environ.get("BCL_BULK_MAX_ITEMS", "10000"))
+IN_CHUNK_SIZE = 500     # параметров в одном IN (...), с запасом до SQLITE_MAX_VARIABLE_NUMBER
+
+
+def bulk_items(data):
+    """Тело bulk-запроса: список объектов или {"items": [...]}."""
+    items = data.get("items") if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        raise BadRequest("items must be a non-empty list")
+    if len(items) > BULK_MAX_ITEMS:
+        raise BadRequest(f"at most {BULK_MAX_ITEMS} items per request")
+    return items
+
+
+def bulk_summary(results, key="status"):
+    """{статус: число элементов} для ответа bulk-запроса."""
+    counts = {}
+    for r in results:
+        counts[r[key]] = counts.get(r[key], 0) + 1
+    return counts
+
+
+def select_by_ids(conn, sql, ids):
+    """
+    Выполняет sql с плейсхолдером {ids} для списка id порциями
+    по IN_CHUNK_SIZE и возвращает все строки.
+    """
+    ids = list(ids)
+    rows = []
+    for start in range(0, len(ids), IN_CHUNK_SIZE):
+        chunk = ids[start:start + IN_CHUNK_SIZE]
+        marks = ", ".join("?" for _ in chunk)
+        rows.extend(conn.execute(sql.format(ids=marks), chunk).fetchall())
+    return rows
+
+
+def _optional_id(value):
+    if value is None:
+        return None
+    pid = int(value)
+    if pid <= 0:
+        raise ValueError
+    return pid
+
+
+@app.post("/api/products/bulk")
+@require_auth
+def bulk_upsert_products():
+    """
+    Upsert списка продуктов одной транзакцией.
+    Элемент с "id" обновляет существующий продукт (или создаётся с этим id),
+    без "id" — создаётся новый. Каждый элемент проходит те же валидации,
+    что и POST /api/products; невалидные элементы пропускаются.
+    Ответ: {"results": [{"index", "id", "status": created|updated|error, "error"?}], ...}
+    """
+    items = bulk_items(request.json)
+
+    results = [None] * len(items)
+    valid = []
+    for index, item in enumerate(items):
+        try:
+            if not isinstance(item, dict):
+                raise BadRequest("item must be an object")
+            try:
+                pid = _optional_id(item.get("id"))
+            except (TypeError, ValueError):
+                raise BadRequest("id must be a positive integer")
+            valid.append((index, pid, validate_product(item), item))
+        except BadRequest as e:
+            pid = item.get("id") if isinstance(item, dict) else None
+            results[index] = {"index": index, "id": pid, "status": "error", "error": str(e)}
+
+    def _job(conn):
+        names = product_columns(conn)
+        fields = [f for f in valid[0][2] if names[f]] if valid else []
+        has_product_id = names["product_id"] is not None
+
+        existing = {
+            r["id"]
+            for r in select_by_ids(
+                conn,
+                "SELECT id FROM products WHERE id IN ({ids})",
+                {pid for _, pid, _, _ in valid if pid},
+            )
+        }
+
+        # id для новых продуктов выдаём сами: писатель один, транзакция
+        # BEGIN IMMEDIATE, поэтому MAX(id) не изменится до COMMIT
+        next_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM products").fetchone()[0]
+        outcomes = []
+        rows = []
+        for index, pid, values, item in valid:
+            if pid is None:
+                next_id += 1
+                pid = next_id
+                status = "created"
+            else:
+                next_id = max(next_id, pid)
+                status = "updated" if pid in existing else "created"
+                existing.add(pid)
+            if status == "updated" and "stock" not in item:
+                values["stock"] = None      # остаток существующего продукта не трогаем
+            row = [pid] + [values[f] for f in fields]
+            if has_product_id:
+                row.append(item.get("product_id"))
+            rows.append(row)
+            outcomes.append((index, pid, status))
+
+        cols = [names[f] for f in fields] + (["product_id"] if has_product_id else [])
+        conn.executemany(
+            f"""
+            INSERT INTO products(id, {', '.join(cols)})
+            VALUES (?, {', '.join('?' for _ in cols)})
+            ON CONFLICT(id) DO UPDATE SET
+                {', '.join(
+                    f"{c} = COALESCE(excluded.{c}, {c})" if f == "stock" else f"{c} = excluded.{c}"
+                    for f, c in zip(fields, cols)
+                )}
+            """,
+            rows,
+        )
+        return outcomes
+
+    outcomes = run_write(_job) if valid else []
+    for index, pid, status in outcomes:
+        results[index] = {"index": index, "id": pid, "status": status}
+
+    if outcomes:
+        invalidate_products([pid for _, pid, _ in outcomes])
+    return jsonify({"results": results, "summary": bulk_summary(results)})
+
+
+@app.patch("/api/products/stock")
+@require_auth
+def bulk_adjust_stock():
+    """
+    Корректировка остатков списком, одной транзакцией:
+        {"items": [{"id": 1, "stock": 40}, {"id": 2, "delta": -3}, ...]}
+    "stock" — новое абсолютное значение, "delta" — изменение. Элементы
+    применяются по порядку; корректировка, после которой остаток стал бы
+    отрицательным, отклоняется (insufficient_stock) и не применяется.
+    """
+    items = bulk_items(request.json)
+
+    results = [None] * len(items)
+    adjustments = []
+    for index, item in enumerate(items):
+        try:
+            pid = int(item["id"])
+            if ("stock" in item) == ("delta" in item):
+                raise ValueError
+            kind = "stock" if "stock" in item else "delta"
+            amount = int(item[kind])
+        except (KeyError, TypeError, ValueError):
+            results[index] = {
+                "index": index,
+                "status": "error",
+                "error": 'item needs integer "id" and exactly one of "stock" / "delta"',
+            }
+            continue
+        adjustments.append((index, pid, kind, amount))
+
+    def _job(conn):
+        stock = {
+            r["id"]: r["stock"] or 0
+            for r in select_by_ids(
+                conn,
+                "SELECT id, stock FROM products WHERE id IN ({ids})",
+                {pid for _, pid, _, _ in adjustments},
+            )
+        }
+
+        outcomes = []
+        for index, pid, kind, amount in adjustments:
+            if pid not in stock:
+                outcomes.append((index, pid, "not_found", None))
+                continue
+            value = amount if kind == "stock" else stock[pid] + amount
+            if value < 0:
+                outcomes.append((index, pid, "insufficient_stock", stock[pid]))
+                continue
+            stock[pid] = value
+            outcomes.append((index, pid, "ok", value))
+
+        changed = {pid for _, pid, status, _ in outcomes if status == "ok"}
+        conn.executemany(
+            "UPDATE products SET stock = ? WHERE id = ?",
+            [(stock[pid], pid) for pid in changed],
+        )
+        return outcomes, changed
+
+    outcomes, changed = run_write(_job) if adjustments else ([], set())
+    for index, pid, status, value in outcomes:
+        results[index] = {"index": index, "id": pid, "status": status, "stock": value}
+
+    if changed:
+        invalidate_products(changed)
+    return jsonify({"results": results, "summary": bulk_summary(results)})
+
+
 # ======================================================================
 # =========================  CUSTOMERS (Session 3)  ====================
 # ======================================================================
 
+CUSTOMER_LIST = {
+    "table": "customers",
+    "from": "customers",
+    "id": "id",
+    "fields": {
+        "id": ("id",),
+        "customer_id": ("customer_id",),
+        "name": ("name", ("TRIM(COALESCE(first_name, '') || ' ' || COALESCE(last_name, ''))",
+                          ("first_name", "last_name"))),
+        "gender": ("gender",),
+        "age": ("age",),
+        "loyalty_status": ("loyalty_status", "membership"),
+        "total_spent": ("total_spent", "total_spending"),
+        "churn_status": ("churn_status",),
+    },
+    "sort": ["id", "name", "loyalty_status", "total_spent"],
+    "filters": {},
+}
+
+
 @app.get("/api/customers")
 @require_auth
+@rate_limit("reporting")
+@conditional("customers")
 def list_customers():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM customers")
-    rows = cur.fetchall()
-    conn.close()
-
-    data = []
-    for r in rows:
-        data.append(
-            {
-                "id": r["id"],
-                "customer_id": row_get(r, "customer_id"),
-                "name": row_get(r, "name"),
-                "gender": row_get(r, "gender"),
-                "age": row_get(r, "age"),
-                "loyalty_status": row_get(r, "loyalty_status"),
-                "total_spent": row_get(r, "total_spent"),
-                "churn_status": row_get(r, "churn_status"),
-            }
-        )
+    args = list_args(CUSTOMER_LIST)
+    fmt = stream_format()
+    if fmt is not None:
+        return stream_list(CUSTOMER_LIST, args, CUSTOMER_ROW, fmt)
+
+    page = page_args()
+    with pooled_connection() as conn:
+        rows, meta = select_list(conn, CUSTOMER_LIST, args, page)
+
+    data = project(map_rows(rows, CUSTOMER_ROW), args["fields"])
+    if page is not None:
+        return page_response(data, meta)
     return jsonify(data)
 
 
+@app.get("/api/customers/changes")
+@require_auth
+@conditional("customers")
+def customer_changes():
+    return changes_response(
+        "customers", "id",
+        lambda conn, ids: map_rows(select_multi(conn, CUSTOMER_LIST, None, ids), CUSTOMER_ROW),
+    )
+
+
 @app.get("/api/customers/<int:cid>")
 @require_auth
+@conditional("customers")
 def get_customer(cid):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM customers WHERE id = ?", (cid,))
-    r = cur.fetchone()
-    conn.close()
+    with pooled_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            f"SELECT {projection(conn, CUSTOMER_LIST)} FROM customers WHERE id = ?",
+            (cid,),
+        )
+        r = cur.fetchone()
 
     if not r:
         return jsonify({"error": "not found"}), 404
 
-    data = {
-        "id": r["id"],
-        "customer_id": row_get(r, "customer_id"),
-        "name": row_get(r, "name"),
-        "gender": row_get(r, "gender"),
-        "age": row_get(r, "age"),
-        "loyalty_status": row_get(r, "loyalty_status"),
-        "total_spent": row_get(r, "total_spent"),
-        "churn_status": row_get(r, "churn_status"),
-    }
-    return jsonify(data)
+    return jsonify(map_row(r, CUSTOMER_ROW))
 
 
 @app.post("/api/customers")
@@ -454,42 +1649,31 @@ def create_customer():
     if not name:
         return jsonify({"error": "name is required"}), 400
 
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO customers(customer_id, name, gender, age,
-                              loyalty_status, total_spent, churn_status)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        """,
-        (
-            data.get("customer_id"),
-            name,
-            data.get("gender"),
-            data.get("age"),
-            data.get("loyalty_status"),
-            data.get("total_spent", 0),
-            data.get("churn_status"),
-        ),
-    )
-    conn.commit()
-    cid = cur.lastrowid
-    cur.execute("SELECT * FROM customers WHERE id = ?", (cid,))
-    r = cur.fetchone()
-    conn.close()
-
-    return jsonify(
-        {
-            "id": r["id"],
-            "customer_id": row_get(r, "customer_id"),
-            "name": row_get(r, "name"),
-            "gender": row_get(r, "gender"),
-            "age": row_get(r, "age"),
-            "loyalty_status": row_get(r, "loyalty_status"),
-            "total_spent": row_get(r, "total_spent"),
-            "churn_status": row_get(r, "churn_status"),
-        }
-    ), 201
+    def _job(conn):
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO customers(customer_id, name, gender, age,
+                                  loyalty_status, total_spent, churn_status)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                data.get("customer_id"),
+                name,
+                data.get("gender"),
+                data.get("age"),
+                data.get("loyalty_status"),
+                data.get("total_spent", 0),
+                data.get("churn_status"),
+            ),
+        )
+        cur.execute(
+            f"SELECT {projection(conn, CUSTOMER_LIST)} FROM customers WHERE id = ?",
+            (cur.lastrowid,),
+        )
+        return map_row(cur.fetchone(), CUSTOMER_ROW)
+
+    return jsonify(run_write(_job)), 201
 
 
 @app.put("/api/customers/<int:cid>")
@@ -519,16 +1703,13 @@ def update_customer(cid):
 
     values.append(cid)
 
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT id FROM customers WHERE id = ?", (cid,))
-    if not cur.fetchone():
-        conn.close()
-        return jsonify({"error": "not found"}), 404
+    def _job(conn):
+        return conn.execute(
+            f"UPDATE customers SET {', '.join(updates)} WHERE id = ?", values
+        ).rowcount
 
-    cur.execute(f"UPDATE customers SET {', '.join(updates)} WHERE id = ?", values)
-    conn.commit()
-    conn.close()
+    if not run_write(_job):
+        return jsonify({"error": "not found"}), 404
     return jsonify({"status": "ok"})
 
 
@@ -536,87 +1717,311 @@ def update_customer(cid):
 # ==========================  ORDERS (Session 3)  ======================
 # ======================================================================
 
+ORDER_HEADER_SQL = """
+    SELECT o.id,
+           o.order_date,
+           o.total_amount,
+           o.status,
+           TRIM(COALESCE(c.first_name, '') || ' ' || COALESCE(c.last_name, '')) AS customer_name
+    FROM orders o
+    LEFT JOIN customers c ON c.id = o.customer_id
+"""
+
+ORDER_LIST = {
+    "table": "orders",
+    "from": "orders o",
+    "join": "LEFT JOIN customers c ON c.id = o.customer_id",
+    "id": "o.id",
+    "fields": {
+        "id": (("o.id", ("id",)),),
+        "order_date": (("o.order_date", ("order_date",)),),
+        "total_amount": (("o.total_amount", ("total_amount",)),),
+        "status": (("o.status", ("status",)),),
+        "customer_id": (("o.customer_id", ("customer_id",)),),
+        "customer_name": (
+            ("TRIM(COALESCE(c.first_name, '') || ' ' || COALESCE(c.last_name, ''))", ()),
+        ),
+    },
+    "sort": ["id", "order_date", "total_amount", "status", "customer_id"],
+    "filters": {
+        "status": ("o.status = ?", str),
+        "customer_id": ("o.customer_id = ?", int),
+        "date_from": ("o.order_date >= ?", str),
+        "date_to": ("o.order_date <= ?", str),
+    },
+}
+
+
+# include=items вкладывает позиции, поэтому ETag зависит и от order_items /
+# products (они всё равно меняются вместе с orders при оформлении заказа)
 @app.get("/api/orders")
 @require_auth
+@rate_limit("reporting")
+@conditional("orders", "customers", "order_items", "products")
 def list_orders():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT o.id,
-               o.order_date,
-               o.total_amount,
-               o.status,
-               c.name AS customer_name
-        FROM orders o
-        LEFT JOIN customers c ON c.id = o.customer_id
-        ORDER BY o.id
-        """
-    )
-    rows = cur.fetchall()
-    conn.close()
-
-    data = []
-    for r in rows:
-        data.append(
-            {
-                "id": r["id"],
-                "order_date": r["order_date"],
-                "total_amount": r["total_amount"],
-                "status": r["status"],
-                "customer_name": r["customer_name"],
-            }
-        )
+    """
+    Фильтры: ?status=&customer_id=&date_from=&date_to= (по order_date)
+    Общие параметры: sort=, fields=, after_id=, limit=, count=1
+    Выборка по списку: ?ids=1,2,3[&include=items] -> {"items": [...], "missing": [...]}
+    """
+    args = list_args(ORDER_LIST)
+    fields = args["fields"] or ["id", "order_date", "total_amount", "status", "customer_name"]
+    args["fields"] = fields
+
+    ids = ids_arg()
+    if ids is not None:
+        return multi_get_orders(ids, fields, "items" in include_arg(["items"]))
+
+    fmt = stream_format()
+    if fmt is not None:
+        return stream_list(ORDER_LIST, args, tuple(field(f) for f in fields), fmt)
+
+    page = page_args()
+    with pooled_connection() as conn:
+        rows, meta = select_list(conn, ORDER_LIST, args, page)
+
+    data = map_rows(rows, tuple(field(f) for f in fields))
+    if page is not None:
+        return page_response(data, meta)
     return jsonify(data)
 
 
+@app.get("/api/orders/changes")
+@require_auth
+@conditional("orders")
+def order_changes():
+    """Состояние заказа — как строка списка /api/orders (и события SSE)."""
+    return changes_response("orders", "id", select_order_rows)
+
+
 @app.get("/api/orders/<int:oid>")
 @require_auth
+@conditional("orders", "order_items", "products", "customers")
 def get_order(oid):
-    conn = get_connection()
+    with pooled_connection() as conn:
+        cur = conn.cursor()
+
+        cur.execute(f"{ORDER_HEADER_SQL} WHERE o.id = ?", (oid,))
+        data = fetch_dict(cur)
+        if not data:
+            return jsonify({"error": "Order not found"}), 404
+
+        data["items"] = select_order_items(conn, [oid]).get(oid, [])
+
+    return jsonify(data)
+
+
+ORDER_ITEM_ROW = tuple(
+    field(f) for f in ("id", "product_id", "product_name", "quantity", "unit_price")
+)
+
+
+def select_order_items(conn, order_ids):
+    """
+    Позиции сразу для списка заказов: один запрос WHERE order_id IN (...)
+    на порцию IN_CHUNK_SIZE, группировка по заказу в памяти.
+    Возвращает {order_id: [позиции]}.
+    """
+    product_name = _resolve_field(
+        PRODUCT_LIST["fields"]["name"], table_columns(conn, "products")
+    )
+    rows = select_by_ids(
+        conn,
+        f"""
+        SELECT oi.order_id,
+               oi.id,
+               oi.product_id,
+               p.{product_name} AS product_name,
+               oi.quantity,
+               oi.unit_price
+        FROM order_items oi
+        JOIN products p ON p.id = oi.product_id
+        WHERE oi.order_id IN ({{ids}})
+        """,
+        order_ids,
+    )
+    grouped = {}
+    if rows:
+        mapper = compile_mapper(rows[0].keys(), ORDER_ITEM_ROW)
+        for row in rows:
+            grouped.setdefault(row["order_id"], []).append(mapper(row))
+    return grouped
+
+
+def multi_get_orders(ids, fields, with_items):
+    """
+    Заказы по списку id: заголовки одним запросом, позиции (include=items)
+    вторым — 2 запроса на порцию вместо 1 + N.
+    """
+    with pooled_connection() as conn:
+        rows = select_multi(conn, ORDER_LIST, fields, ids)
+        row_spec = tuple(field(f) for f in ["id"] + [f for f in fields if f != "id"])
+        data = map_rows(rows, row_spec)
+        if with_items and data:
+            items = select_order_items(conn, [d["id"] for d in data])
+            for d in data:
+                d["items"] = items.get(d["id"], [])
+
+    if with_items:
+        fields = list(fields) + ["items"]
+    return multi_response(data, ids, fields)
+
+
+class OrderRejected(Exception):
+    """Заказ отклонён внутри задания писателя; изменения задания откатываются."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def _parse_order_items(items):
+    """
+    Проверяет позиции заказа и суммирует количество по продукту.
+    Возвращает [(product_id, quantity), ...] в исходном порядке
+    и {product_id: суммарное количество}.
+    """
+    lines = []
+    totals = {}
+    for it in items:
+        try:
+            pid = int(it.get("product_id") or 0)
+            qty = int(it.get("quantity", 0))
+        except (AttributeError, TypeError, ValueError):
+            return None, None
+        if pid <= 0 or qty <= 0:
+            return None, None
+        lines.append((pid, qty))
+        totals[pid] = totals.get(pid, 0) + qty
+    return lines, totals
+
+
+def _place_order(conn, customer_id, lines, totals):
+    """
+    Задание писателя: выполняется внутри транзакции BEGIN IMMEDIATE.
+    Все продукты читаются одним запросом IN (...), остаток списывается
+    условным UPDATE ... WHERE stock >= ?, поэтому продать больше, чем
+    есть на складе, нельзя даже при параллельных заказах.
+    """
     cur = conn.cursor()
 
+    cur.execute("SELECT id FROM customers WHERE id = ?", (customer_id,))
+    if not cur.fetchone():
+        raise OrderRejected("customer does not exist", 404)
+
+    pids = list(totals)
+    marks = ", ".join("?" for _ in pids)
+    cur.execute(f"SELECT id, price FROM products WHERE id IN ({marks})", pids)
+    prices = {r["id"]: r["price"] for r in cur.fetchall()}
+
+    for pid in pids:
+        if pid not in prices:
+            raise OrderRejected(f"product_id {pid} not found", 404)
+
+    # Резервируем остаток: строка обновится только если товара хватает
+    for pid, qty in totals.items():
+        cur.execute(
+            "UPDATE products SET stock = stock - ? WHERE id = ? AND stock >= ?",
+            (qty, pid, qty),
+        )
+        if cur.rowcount == 0:
+            raise OrderRejected(f"not enough stock for product {pid}")
+
+    order_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    total_amount = sum(prices[pid] * qty for pid, qty in lines)
+
     cur.execute(
         """
-        SELECT o.id,
-               o.order_date,
-               o.total_amount,
-               o.status,
-               c.name AS customer_name
-        FROM orders o
-        LEFT JOIN customers c ON c.id = o.customer_id
-        WHERE o.id = ?
+        INSERT INTO orders(customer_id, order_date, total_amount, status)
+        VALUES (?, ?, ?, ?)
         """,
-        (oid,),
+        (customer_id, order_date, total_amount, "Pending"),
     )
-    row = cur.fetchone()
-    if not row:
-        conn.close()
-        return jsonify({"error": "Order not found"}), 404
+    order_id = cur.lastrowid
 
-    cur.execute(
+    cur.executemany(
         """
-        SELECT oi.id,
-               oi.product_id,
-               p.product_name AS product_name,
-               oi.quantity,
-               oi.price AS unit_price
-        FROM order_items oi
-        JOIN products p ON p.id = oi.product_id
-        WHERE oi.order_id = ?
+        INSERT INTO order_items(order_id, product_id, quantity, unit_price)
+        VALUES (?, ?, ?, ?)
+        """,
+        [(order_id, pid, qty, prices[pid]) for pid, qty in lines],
+    )
+    return order_id
+
+
+# ----------------------- IDEMPOTENCY -----------------------
+#
+# Клиент может передать заголовок Idempotency-Key. Ответ на первый
+# успешный запрос с этим ключом сохраняется в idempotency_keys в той же
+# транзакции, что и сам заказ; повтор с тем же ключом возвращает
+# сохранённый ответ, не создавая заказ и не списывая остатки повторно.
+# Отклонённые запросы (4xx) не сохраняются: повтор безопасен, т.к.
+# ничего не изменилось.
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+IDEMPOTENCY_TTL = float(os.environ.get("BCL_IDEMPOTENCY_TTL", "86400"))
+
+
+def idempotency_key():
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    if key is None:
+        return None
+    key = key.strip()
+    if not key or len(key) > 255:
+        raise BadRequest(f"{IDEMPOTENCY_HEADER} must be 1..255 characters")
+    return key
+
+
+def request_fingerprint(*parts):
+    return hashlib.sha256(dumps_bytes(parts)).hexdigest()
+
+
+def load_idempotent(conn, key, fingerprint):
+    """Сохранённый (status, body) для ключа или None, если ключа нет / он истёк."""
+    row = conn.execute(
+        "SELECT request_hash, status, body FROM idempotency_keys "
+        "WHERE key = ? AND expires_at > ?",
+        (key, time.time()),
+    ).fetchone()
+    if row is None:
+        return None
+    if row["request_hash"] != fingerprint:
+        raise OrderRejected(f"{IDEMPOTENCY_HEADER} was already used with a different request", 422)
+    return row["status"], bytes(row["body"])
+
+
+def save_idempotent(conn, key, fingerprint, status, body):
+    now = time.time()
+    conn.execute("DELETE FROM idempotency_keys WHERE expires_at <= ?", (now,))
+    conn.execute(
+        """
+        INSERT OR REPLACE INTO idempotency_keys(key, request_hash, status, body, created_at, expires_at)
+        VALUES (?, ?, ?, ?, ?, ?)
         """,
-        (oid,),
+        (key, fingerprint, status, body, now, now + IDEMPOTENCY_TTL),
     )
-    items = [dict(r) for r in cur.fetchall()]
-    conn.close()
 
-    data = dict(row)
-    data["items"] = items
-    return jsonify(data)
+
+def _place_order_once(conn, key, fingerprint, customer_id, lines, totals):
+    """
+    Задание писателя: повторная проверка ключа уже внутри транзакции
+    (параллельный повтор мог успеть раньше), затем заказ и сохранение ответа.
+    Возвращает ((status, body), replayed).
+    """
+    stored = load_idempotent(conn, key, fingerprint)
+    if stored is not None:
+        return stored, True
+
+    order_id = _place_order(conn, customer_id, lines, totals)
+    body = dumps_bytes({"order_id": order_id, "status": "Pending"})
+    save_idempotent(conn, key, fingerprint, 201, body)
+    return (201, body), False
 
 
 @app.post("/api/orders")
 @require_auth
+@rate_limit("orders")
 def create_order():
     """
     JSON:
@@ -627,6 +2032,8 @@ def create_order():
         ...
       ]
     }
+    Необязательный заголовок Idempotency-Key: повтор запроса с тем же
+    ключом возвращает исходный ответ (с заголовком Idempotent-Replayed: true).
     """
     data = request.json or {}
     customer_id = data.get("customer_id")
@@ -637,147 +2044,383 @@ def create_order():
     if not items:
         return jsonify({"error": "items list is empty"}), 400
 
-    conn = get_connection()
-    cur = conn.cursor()
-
-    # Проверка покупателя
-    cur.execute("SELECT id FROM customers WHERE id = ?", (customer_id,))
-    if not cur.fetchone():
-        conn.close()
-        return jsonify({"error": "customer does not exist"}), 404
+    lines, totals = _parse_order_items(items)
+    if lines is None:
+        return jsonify({"error": "invalid product_id or quantity"}), 400
 
-    # Проверка продуктов + stock
-    product_map = {}
-    for it in items:
-        pid = it.get("product_id")
-        qty = it.get("quantity", 0)
+    key = idempotency_key()
+    if key is None:
+        try:
+            order_id = run_write(_place_order, customer_id, lines, totals)
+        except OrderRejected as e:
+            return jsonify({"error": e.message}), e.status
 
-        if not pid or qty <= 0:
-            conn.close()
-            return jsonify({"error": "invalid product_id or quantity"}), 400
+        invalidate_products(totals)
+        order_events.notify()
+        return jsonify({"order_id": order_id, "status": "Pending"}), 201
 
-        cur.execute("SELECT id, price, stock FROM products WHERE id = ?", (pid,))
-        row = cur.fetchone()
-        if not row:
-            conn.close()
-            return jsonify({"error": f"product_id {pid} not found"}), 404
-
-        if row["stock"] < qty:
-            conn.close()
-            return jsonify({"error": f"not enough stock for product {pid}"}), 400
-
-        product_map[pid] = row
-
-    # Создаём заказ
-    from datetime import datetime
-
-    order_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    total_amount = sum(product_map[i["product_id"]]["price"] * i["quantity"] for i in items)
-
-    cur.execute(
-        """
-        INSERT INTO orders(customer_id, order_date, total_amount, status)
-        VALUES (?, ?, ?, ?)
-        """,
-        (customer_id, order_date, total_amount, "Pending"),
-    )
-    order_id = cur.lastrowid
-
-    # Позиции заказа + изменение stock
-    for it in items:
-        pid = it["product_id"]
-        qty = it["quantity"]
-        price = product_map[pid]["price"]
-
-        cur.execute(
-            """
-            INSERT INTO order_items(order_id, product_id, quantity, price)
-            VALUES (?, ?, ?, ?)
-            """,
-            (order_id, pid, qty, price),
-        )
-
-        cur.execute(
-            "UPDATE products SET stock = stock - ? WHERE id = ?",
-            (qty, pid),
-        )
-
-    conn.commit()
-    conn.close()
+    fingerprint = request_fingerprint("POST /api/orders", customer_id, lines)
+    try:
+        # Быстрый путь: повтор отвечается чтением, без очереди писателя
+        with pooled_connection() as conn:
+            stored = load_idempotent(conn, key, fingerprint)
+        replayed = stored is not None
+        if not replayed:
+            stored, replayed = run_write(
+                _place_order_once, key, fingerprint, customer_id, lines, totals
+            )
+    except OrderRejected as e:
+        return jsonify({"error": e.message}), e.status
 
-    return jsonify({"order_id": order_id, "status": "Pending"}), 201
+    status, body = stored
+    if not replayed:
+        invalidate_products(totals)
+        order_events.notify()
+    resp = Response(body, status=status, mimetype="application/json")
+    if replayed:
+        resp.headers["Idempotent-Replayed"] = "true"
+    return resp
 
 
 @app.put("/api/orders/<int:oid>/processing")
 @require_auth
+@rate_limit("orders")
 def processing_order(oid):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("UPDATE orders SET status = 'Processing' WHERE id = ?", (oid,))
-    if cur.rowcount == 0:
-        conn.close()
+    def _job(conn):
+        return conn.execute(
+            "UPDATE orders SET status = 'Processing' WHERE id = ?", (oid,)
+        ).rowcount
+
+    if not run_write(_job):
         return jsonify({"error": "Order not found"}), 404
-    conn.commit()
-    conn.close()
+    order_events.notify()
     return jsonify({"status": "Processing"})
 
 
 @app.put("/api/orders/<int:oid>/complete")
 @require_auth
+@rate_limit("orders")
 def complete_order(oid):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("UPDATE orders SET status = 'Completed' WHERE id = ?", (oid,))
-    if cur.rowcount == 0:
-        conn.close()
+    def _job(conn):
+        return conn.execute(
+            "UPDATE orders SET status = 'Completed' WHERE id = ?", (oid,)
+        ).rowcount
+
+    if not run_write(_job):
         return jsonify({"error": "Order not found"}), 404
-    conn.commit()
-    conn.close()
+    order_events.notify()
     return jsonify({"status": "Completed"})
 
 
 @app.put("/api/orders/<int:oid>/cancel")
 @require_auth
+@rate_limit("orders")
 def cancel_order(oid):
     """
     Session 3 Acceptance Tests:
     - отмена заказа помечает статус 'Cancelled'
     - ВОССТАНАВЛИВАЕТ запасы (stock) по позициям заказа
     """
-    conn = get_connection()
-    cur = conn.cursor()
+    def _job(conn):
+        cur = conn.cursor()
 
-    # Сначала смотрим текущий статус
-    cur.execute("SELECT status FROM orders WHERE id = ?", (oid,))
-    row = cur.fetchone()
-    if not row:
-        conn.close()
+        # Сначала смотрим текущий статус
+        cur.execute("SELECT status FROM orders WHERE id = ?", (oid,))
+        row = cur.fetchone()
+        if not row:
+            return None, []
+
+        current_status = row["status"]
+        if current_status == "Cancelled":
+            return "AlreadyCancelled", []
+
+        # Получаем позиции заказа
+        cur.execute(
+            "SELECT product_id, quantity FROM order_items WHERE order_id = ?",
+            (oid,),
+        )
+        items = cur.fetchall()
+
+        # Восстанавливаем stock
+        for it in items:
+            cur.execute(
+                "UPDATE products SET stock = stock + ? WHERE id = ?",
+                (it["quantity"], it["product_id"]),
+            )
+
+        # Меняем статус
+        cur.execute("UPDATE orders SET status = 'Cancelled' WHERE id = ?", (oid,))
+        return "Cancelled", [it["product_id"] for it in items]
+
+    status, pids = run_write(_job)
+    if status is None:
         return jsonify({"error": "Order not found"}), 404
+    if pids:
+        invalidate_products(pids)
+    if status == "Cancelled":
+        order_events.notify()
+    return jsonify({"status": status}), 200
+
+
+# Целевой статус -> статусы, из которых в него можно перейти
+ORDER_TRANSITIONS = {
+    "Processing": {"Pending"},
+    "Completed": {"Pending", "Processing"},
+    "Cancelled": {"Pending", "Processing", "Completed"},
+}
+
+# Действия одиночных эндпоинтов тоже принимаются как целевой статус
+ORDER_STATUS_ALIASES = {
+    "processing": "Processing",
+    "complete": "Completed",
+    "completed": "Completed",
+    "cancel": "Cancelled",
+    "cancelled": "Cancelled",
+}
+
+
+def _transition_orders(conn, ids, target):
+    """
+    Задание писателя: переводит заказы ids в статус target.
+    Возвращает ({id: (outcome, прежний статус)}, id продуктов с изменённым остатком).
+    Допустимые заказы обновляются одним UPDATE, остатки при отмене
+    восстанавливаются одним UPDATE по сумме позиций всех отменяемых заказов.
+    """
+    current = {
+        r["id"]: r["status"]
+        for r in select_by_ids(conn, "SELECT id, status FROM orders WHERE id IN ({ids})", ids)
+    }
 
-    current_status = row["status"]
-    if current_status == "Cancelled":
-        conn.close()
-        return jsonify({"status": "AlreadyCancelled"}), 200
+    outcomes = {}
+    apply = []
+    for oid in ids:
+        status = current.get(oid)
+        if oid not in current:
+            outcomes[oid] = ("not_found", None)
+        elif status == target:
+            outcomes[oid] = ("unchanged", status)
+        elif status not in ORDER_TRANSITIONS[target]:
+            outcomes[oid] = ("invalid_transition", status)
+        else:
+            outcomes[oid] = ("ok", status)
+            apply.append(oid)
+
+    if not apply:
+        return outcomes, []
+
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS batch_order_ids (id INTEGER PRIMARY KEY)")
+    conn.execute("DELETE FROM temp.batch_order_ids")
+    conn.executemany("INSERT INTO temp.batch_order_ids(id) VALUES (?)", [(oid,) for oid in apply])
+
+    pids = []
+    if target == "Cancelled":
+        pids = [
+            r[0]
+            for r in conn.execute(
+                """
+                SELECT DISTINCT product_id FROM order_items
+                WHERE order_id IN (SELECT id FROM temp.batch_order_ids)
+                """
+            )
+        ]
+        conn.execute(
+            """
+            UPDATE products
+            SET stock = stock + (
+                SELECT SUM(oi.quantity) FROM order_items oi
+                WHERE oi.product_id = products.id
+                  AND oi.order_id IN (SELECT id FROM temp.batch_order_ids)
+            )
+            WHERE id IN (
+                SELECT product_id FROM order_items
+                WHERE order_id IN (SELECT id FROM temp.batch_order_ids)
+            )
+            """
+        )
 
-    # Получаем позиции заказа
-    cur.execute(
-        "SELECT product_id, quantity FROM order_items WHERE order_id = ?",
-        (oid,),
+    conn.execute(
+        "UPDATE orders SET status = ? WHERE id IN (SELECT id FROM temp.batch_order_ids)",
+        (target,),
     )
-    items = cur.fetchall()
+    conn.execute("DELETE FROM temp.batch_order_ids")
+    return outcomes, pids
 
-    # Восстанавливаем stock
-    for it in items:
-        cur.execute(
-            "UPDATE products SET stock = stock + ? WHERE id = ?",
-            (it["quantity"], it["product_id"]),
-        )
 
-    # Меняем статус
-    cur.execute("UPDATE orders SET status = 'Cancelled' WHERE id = ?", (oid,))
-    conn.commit()
-    conn.close()
-    return jsonify({"status": "Cancelled"})
+@app.post("/api/orders/status")
+@require_auth
+@rate_limit("orders")
+def batch_order_status():
+    """
+    Пакетная смена статуса в одной транзакции:
+        {"ids": [1, 2, 3], "status": "Completed"}
+    status: Processing | Completed | Cancelled (или processing/complete/cancel).
+    Ответ: {"status", "results": [{"id", "outcome": ok|unchanged|
+    invalid_transition|not_found, "previous"}], "summary"}
+    """
+    data = request.json or {}
+    target = ORDER_STATUS_ALIASES.get(str(data.get("status", "")).lower())
+    if target is None:
+        raise BadRequest("status must be one of: Processing, Completed, Cancelled")
+
+    raw_ids = data.get("ids")
+    if not isinstance(raw_ids, list) or not raw_ids:
+        raise BadRequest("ids must be a non-empty list")
+    if len(raw_ids) > BULK_MAX_ITEMS:
+        raise BadRequest(f"at most {BULK_MAX_ITEMS} ids per request")
+    try:
+        ids = list(dict.fromkeys(int(i) for i in raw_ids))
+    except (TypeError, ValueError):
+        raise BadRequest("ids must be integers")
+
+    outcomes, pids = run_write(_transition_orders, ids, target)
+    if pids:
+        invalidate_products(pids)
+    changed = [oid for oid, (outcome, _) in outcomes.items() if outcome == "ok"]
+    if changed:
+        order_events.notify()
+
+    results = [
+        {"id": oid, "outcome": outcome, "previous": previous}
+        for oid, (outcome, previous) in outcomes.items()
+    ]
+    return jsonify({"status": target, "results": results, "summary": bulk_summary(results, "outcome")})
+
+
+# ----------------------- EVENTS (SSE) -----------------------
+
+SSE_HEARTBEAT = float(os.environ.get("BCL_SSE_HEARTBEAT", "15"))
+SSE_MAX_SECONDS = float(os.environ.get("BCL_SSE_MAX_SECONDS", "300"))
+# Как часто поток перечитывает row_changes (записи других воркеров), сек
+SSE_POLL_INTERVAL = float(os.environ.get("BCL_SSE_POLL_INTERVAL", "1"))
+SSE_BATCH_SIZE = 500
+
+
+def sse_client_limit(threads):
+    """
+    Пока поток ждёт событие, он занят (и под WSGI, и в пуле api/asgi.py).
+    По умолчанию подписчикам отдаётся четверть потоков сервера и никогда
+    не больше половины (BCL_SSE_MAX_CLIENTS ограничивается тем же).
+    """
+    requested = os.environ.get("BCL_SSE_MAX_CLIENTS")
+    wanted = int(requested) if requested else threads // 4
+    return max(0, min(wanted, threads // 2))
+
+
+order_events = ChangeNotifier()
+sse_clients = ConcurrencyLimit(sse_client_limit(int(os.environ.get("BCL_THREADS", "4"))))
+
+
+def set_server_threads(threads):
+    """Точка входа сообщает число потоков обработки до начала приёма запросов."""
+    global sse_clients
+    sse_clients = ConcurrencyLimit(sse_client_limit(threads))
+
+
+ORDER_EVENT_ROW = tuple(
+    field(f) for f in ("id", "order_date", "total_amount", "status", "customer_name")
+)
+
+# Статус -> тип события; заказ создаётся в Pending и обратно в него не переходит
+ORDER_EVENT_TYPES = {"Pending": "order.created", "Cancelled": "order.cancelled"}
+
+
+def select_order_rows(conn, order_ids):
+    """Заказы ids в форме строки списка /api/orders."""
+    rows = select_by_ids(conn, ORDER_HEADER_SQL + " WHERE o.id IN ({ids})", order_ids)
+    return map_rows(rows, ORDER_EVENT_ROW)
+
+
+def _order_stream_start(conn, last_event_id):
+    """
+    Версия orders в row_changes, после которой продолжать поток, и нужен
+    ли клиенту reset. Без Last-Event-ID — только новые изменения.
+    """
+    latest = conn.execute(
+        "SELECT COALESCE(MAX(version), 0) FROM row_changes WHERE tbl = 'orders'"
+    ).fetchone()[0]
+    if not last_event_id:
+        return latest, False
+    try:
+        version = int(last_event_id)
+    except ValueError:
+        return latest, True
+    if version < 0 or version > latest:
+        # Чужой id (старый формат, другая БД) — данные нужно перечитать
+        return latest, True
+    return version, False
+
+
+def _sse(event_type, data=None, event_id=None):
+    chunk = b""
+    if event_id is not None:
+        chunk += f"id: {event_id}\n".encode("ascii")
+    chunk += f"event: {event_type}\n".encode("ascii")
+    chunk += b"data: " + dumps_bytes(data if data is not None else {}) + b"\n\n"
+    return chunk
+
+
+@app.get("/api/orders/events")
+@require_auth
+def order_event_stream():
+    """
+    Server-Sent Events: order.created / order.status / order.cancelled /
+    order.deleted, data — заказ в формате строки /api/orders (для
+    удалённого — только id). id события — версия строки в row_changes,
+    общей для всех воркеров, поэтому поток видит любые записи в БД.
+    Первое событие ready (или reset) сообщает текущую версию.
+    Повторное подключение с Last-Event-ID (или ?last_event_id=) досылает
+    текущее состояние заказов, изменённых с тех пор; на незнакомый id
+    приходит reset — список нужно перечитать целиком.
+    Соединение закрывается через BCL_SSE_MAX_SECONDS, клиент переподключается.
+    """
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    with pooled_connection() as conn:
+        start, reset = _order_stream_start(conn, last_event_id)
+
+    if not sse_clients.try_acquire():
+        return _too_many("sse_clients", SSE_HEARTBEAT)
+
+    def generate():
+        deadline = time.monotonic() + SSE_MAX_SECONDS
+        position = start
+        seen = order_events.current()
+        last_sent = time.monotonic()
+        yield b"retry: 3000\n\n"
+        yield _sse("reset" if reset else "ready", event_id=position)
+        while time.monotonic() < deadline:
+            with pooled_connection() as conn:
+                rows, has_more = select_row_changes(conn, "orders", position, SSE_BATCH_SIZE)
+                ids = [r["row_id"] for r in rows if not r["deleted"]]
+                orders = {o["id"]: o for o in select_order_rows(conn, ids)} if ids else {}
+
+            if rows:
+                chunks = []
+                for r in rows:
+                    order = orders.get(r["row_id"])
+                    if order is None:
+                        chunks.append(_sse("order.deleted", {"id": r["row_id"]}, r["version"]))
+                    else:
+                        event_type = ORDER_EVENT_TYPES.get(order["status"], "order.status")
+                        chunks.append(_sse(event_type, order, r["version"]))
+                yield b"".join(chunks)
+                position = rows[-1]["version"]
+                last_sent = time.monotonic()
+                if has_more:
+                    continue
+            elif time.monotonic() - last_sent >= SSE_HEARTBEAT:
+                yield b": keepalive\n\n"
+                last_sent = time.monotonic()
+
+            # Запись в этом процессе будит сразу, записи других — через опрос
+            timeout = min(SSE_POLL_INTERVAL, deadline - time.monotonic())
+            if timeout > 0:
+                seen = order_events.wait(seen, timeout)
+
+    resp = Response(generate(), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"
+    resp.call_on_close(sse_clients.release)
+    return resp
 
 
 # ======================================================================
@@ -786,12 +2429,12 @@ def cancel_order(oid):
 
 @app.get("/api/promotions")
 @require_auth
+@conditional("promotions")
 def list_promotions():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM promotions")
-    rows = [dict(r) for r in cur.fetchall()]
-    conn.close()
+    with pooled_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT * FROM promotions")
+        rows = fetch_dicts(cur)
     return jsonify(rows)
 
 
@@ -799,44 +2442,57 @@ def list_promotions():
 @require_auth
 def create_promotion():
     data = request.json or {}
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO promotions(name, discount_type, discount_value,
-                               start_date, end_date, min_order_value, priority)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        """,
-        (
-            data.get("name", ""),
-            data.get("discount_type", "percent"),
-            float(data.get("discount_value", 0)),
-            data.get("start_date", ""),
-            data.get("end_date", ""),
-            data.get("min_order_value"),
-            int(data.get("priority", 1)),
-        ),
-    )
-    conn.commit()
-    pid = cur.lastrowid
-    conn.close()
 
-    return jsonify({"id": pid}), 201
+    def _job(conn):
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO promotions(name, discount_type, discount_value,
+                                   start_date, end_date, min_order_value, priority)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                data.get("name", ""),
+                data.get("discount_type", "percent"),
+                float(data.get("discount_value", 0)),
+                data.get("start_date", ""),
+                data.get("end_date", ""),
+                data.get("min_order_value"),
+                int(data.get("priority", 1)),
+            ),
+        )
+        return cur.lastrowid
+
+    return jsonify({"id": run_write(_job)}), 201
+
+
+@app.get("/api/loyalty/changes")
+@require_auth
+@conditional("loyalty")
+def loyalty_changes():
+    """Строки loyalty адресуются по customer_id, как в /api/loyalty/<cid>."""
+    return changes_response(
+        "loyalty", "customer_id",
+        lambda conn, ids: [
+            dict(r) for r in
+            select_by_ids(conn, "SELECT * FROM loyalty WHERE customer_id IN ({ids})", ids)
+        ],
+    )
 
 
 @app.get("/api/loyalty/<int:cid>")
 @require_auth
+@conditional("loyalty")
 def get_loyalty(cid):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM loyalty WHERE customer_id = ?", (cid,))
-    row = cur.fetchone()
-    conn.close()
+    with pooled_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT * FROM loyalty WHERE customer_id = ?", (cid,))
+        row = fetch_dict(cur)
 
     if not row:
         return jsonify({"customer_id": cid, "points": 0})
 
-    return jsonify(dict(row))
+    return jsonify(row)
 
 
 @app.put("/api/loyalty/<int:cid>")
@@ -845,26 +2501,177 @@ def update_loyalty(cid):
     data = request.json or {}
     points = int(data.get("points", 0))
 
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO loyalty(customer_id, points) VALUES(?, ?)
-        ON CONFLICT(customer_id) DO UPDATE SET points = excluded.points
-        """,
-        (cid, points),
-    )
-    conn.commit()
-    conn.close()
+    def _job(conn):
+        conn.execute(
+            """
+            INSERT INTO loyalty(customer_id, points) VALUES(?, ?)
+            ON CONFLICT(customer_id) DO UPDATE SET points = excluded.points
+            """,
+            (cid, points),
+        )
+
+    run_write(_job)
 
     return jsonify({"status": "ok"})
 
 
+# ======================================================================
+# ============================  SERVICE  ===============================
+# ======================================================================
+
+@app.get("/api/pool/stats")
+@require_auth
+def db_pool_stats():
+    """Статистика пула соединений (hits / misses / waits) для подбора размера."""
+    return jsonify(pool_stats())
+
+
+@app.get("/api/cache/stats")
+@require_auth
+def product_cache_stats():
+    """Попадания / промахи кеша каталога."""
+    return jsonify(product_cache.stats())
+
+
+@app.get("/api/hashing/stats")
+@require_auth
+def hashing_stats():
+    """Пул хеширования паролей: выполнено, отклонено при перегрузке, в работе."""
+    return jsonify(get_hashing_pool().stats())
+
+
+@app.get("/metrics")
+@require_auth
+def prometheus_metrics():
+    """Метрики процесса в текстовом формате Prometheus."""
+    body = metrics.render(
+        [REQUEST_LATENCY, REQUEST_STAGE, REQUESTS_TOTAL, DB_QUERIES, IN_FLIGHT, REJECTED]
+    )
+    extra = (
+        metrics.render_stats("bcl_db_pool", pool_stats(), "Connection pool")
+        + metrics.render_stats("bcl_db_writer", writer_stats(), "DB writer")
+        + metrics.render_stats("bcl_product_cache", product_cache.stats(), "Product cache")
+        + metrics.render_stats("bcl_hashing", get_hashing_pool().stats(), "Password hashing pool")
+        + metrics.render_stats(
+            "bcl_order_events",
+            {"sse_clients": sse_clients.active, **order_events.stats()},
+            "Order event stream",
+        )
+        + metrics.render_stats(
+            "bcl_admission",
+            {"expensive_active": expensive_requests.active, **rate_limiter.stats()},
+            "Admission control",
+        )
+    )
+    body += "\n".join(extra) + "\n"
+    return Response(body, mimetype="text/plain; version=0.0.4")
+
+
+@app.get("/api/writer/stats")
+@require_auth
+def db_writer_stats():
+    """Статистика потока-писателя: число заданий, транзакций, средняя пачка."""
+    return jsonify(writer_stats())
+
+
 # ======================================================================
 # ==============================  RUN  =================================
 # ======================================================================
 
+# Списки каталога, которые прогреваются при старте (URL как в request.full_path)
+WARM_PRODUCT_URLS = ["/api/products", f"/api/products?limit={DEFAULT_PAGE_LIMIT}"]
+WARM_CONNECTIONS = int(os.environ.get("BCL_WARM_CONNECTIONS", "4"))
+
+_ready = {"ready": False, "warmup_seconds": None}
+
+
+def create_app(warm=True):
+    """
+    Фабрика для WSGI-серверов (см. wsgi.py, gunicorn.conf.py).
+    Схема и миграции (init_db) выполняются один раз при загрузке
+    приложения — с preload_app в мастер-процессе до запуска воркеров,
+    а не на первом запросе. Без preload (uvicorn --workers) init_db
+    вызывает каждый воркер, но под межпроцессной блокировкой (init_lock):
+    остальные ждут первого и находят базу готовой. Затем warm_up(); серверы, которые стартуют
+    воркеры отдельно, вызывают warm_up() в каждом воркере сами.
+    """
+    if not hasattr(app, "_db_init_done"):
+        init_db()
+        load_session_secret()
+        app._db_init_done = True
+    if warm:
+        warm_up()
+    return app
+
+
+def warm_up():
+    """
+    Прогрев воркера до того, как он начнёт принимать запросы:
+      - открывает соединения пула и готовит в них частые запросы
+        (кеш подготовленных инструкций sqlite3 живёт в соединении);
+      - заполняет кеш каталога карточками и основными списками;
+      - PRAGMA optimize.
+    По окончании /api/ready отвечает 200.
+    """
+    started = time.perf_counter()
+    pool = get_pool()
+    conns = [pool.acquire() for _ in range(min(WARM_CONNECTIONS, pool.size))]
+    try:
+        for conn in conns:
+            table_versions(conn, VERSIONED_TABLES)
+            conn.execute(f"{ORDER_HEADER_SQL} WHERE o.id = ?", (0,)).fetchall()
+            conn.execute("SELECT * FROM products WHERE id = ?", (0,)).fetchall()
+            conn.execute("SELECT * FROM customers WHERE id = ?", (0,)).fetchall()
+        conn = conns[0]
+        conn.execute("PRAGMA optimize")
+
+        version = table_versions(conn, ["products"]).get("products", (0, 0))[0]
+        sync_product_cache(version)
+        generation = product_cache.generation
+        rows = conn.execute(
+            f"SELECT {projection(conn, PRODUCT_LIST)} FROM products ORDER BY id LIMIT ?",
+            (PRODUCT_CACHE_SIZE // 2,),
+        ).fetchall()
+        for product in map_rows(rows, PRODUCT_ROW):
+            product_cache.set(("item", product["id"]), product, generation)
+    finally:
+        for conn in conns:
+            pool.release(conn)
+
+    for url in WARM_PRODUCT_URLS:
+        with app.test_request_context(url):
+            product_list_body()
+
+    _ready["ready"] = True
+    _ready["warmup_seconds"] = round(time.perf_counter() - started, 3)
+    print(f"Worker {os.getpid()} warmed up in {_ready['warmup_seconds']}s")
+
+
+def shutdown():
+    """
+    Корректная остановка воркера: поток-писатель выполняет и коммитит
+    уже поставленные задания, затем закрываются соединения пула.
+    """
+    _ready["ready"] = False
+    stop_writer()
+    close_pool()
+
+
+@app.get("/api/ready")
+def readiness():
+    """
+    Проба готовности для балансировщика (без авторизации): 200 после
+    warm_up(), 503 до него и во время остановки.
+    """
+    status = 200 if _ready["ready"] else 503
+    body = {"status": "ready" if _ready["ready"] else "starting", "pid": os.getpid()}
+    body["warmup_seconds"] = _ready["warmup_seconds"]
+    return jsonify(body), status
+
+
 if __name__ == "__main__":
-    init_db()
+    # Сервер разработки. Для нагрузки: gunicorn -c gunicorn.conf.py wsgi:app
+    # или python serve.py (waitress, Windows)
+    create_app()
     print(">>> Server running on http://127.0.0.1:5000")
     app.run(debug=True)
@@ -0,0 +1,12 @@
+"""
+ASGI-точка входа: те же маршруты, что и wsgi.py, обработчики — в пуле потоков.
+
+    uvicorn asgi:app --host 127.0.0.1 --port 5000 --workers 4
+
+Размер пула потоков на процесс — BCL_ASGI_THREADS (по умолчанию 16).
+"""
+from api.asgi import ASGI_THREADS, WSGIBridge
+from api.server import create_app, set_server_threads, shutdown, warm_up
+
+set_server_threads(ASGI_THREADS)
+app = application = WSGIBridge(create_app(warm=False), on_startup=warm_up, on_shutdown=shutdown)
@@ -0,0 +1,82 @@
+"""
+Нагрузочный микробенчмарк API: N клиентских потоков с keep-alive
+выполняют GET в течение заданного времени, выводятся req/s и задержки.
+
+Порядок замера масштабирования по воркерам (из каталога project):
+
+    BCL_WORKERS=1 BCL_THREADS=4 gunicorn -c gunicorn.conf.py wsgi:app &
+    python -m benchmarks.bench_http --path /api/orders/5000 --clients 16
+    (остановить сервер, повторить с BCL_WORKERS=2, 4, ...)
+
+Для сравнения — сервер разработки (python api/server.py) с тем же URL.
+Замерять лучше путь, не попадающий в кеш каталога (например, заказ),
+иначе измеряется в основном сериализация готовых байтов.
+"""
+import argparse
+import base64
+import http.client
+import threading
+import time
+
+
+def worker(host, port, path, headers, deadline, latencies, errors):
+    conn = http.client.HTTPConnection(host, port, timeout=10)
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            conn.request("GET", path, headers=headers)
+            resp = conn.getresponse()
+            resp.read()
+            if resp.status != 200:
+                errors.append(resp.status)
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(type(e).__name__)
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=10)
+            continue
+        latencies.append(time.perf_counter() - started)
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--path", default="/api/orders?limit=50")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--user", default="staff:BCLyon2024")
+    args = parser.parse_args()
+
+    token = base64.b64encode(args.user.encode()).decode()
+    headers = {"Authorization": f"Basic {token}"}
+
+    latencies, errors = [], []
+    deadline = time.perf_counter() + args.duration
+    threads = [
+        threading.Thread(
+            target=worker,
+            args=(args.host, args.port, args.path, headers, deadline, latencies, errors),
+        )
+        for _ in range(args.clients)
+    ]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0
+
+    print(f"{args.path}  clients={args.clients}  {elapsed:.1f}s")
+    print(f"  requests: {len(latencies)}  errors: {len(errors)}")
+    print(f"  req/s:    {len(latencies) / elapsed:,.0f}")
+    print(f"  latency:  p50 {pct(0.5):.1f} ms  p95 {pct(0.95):.1f} ms  p99 {pct(0.99):.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Микробенчмарк сериализации списков: старый путь (row_get на каждое поле +
+стандартный json) против скомпилированного маппера + orjson.
+
+Запуск из каталога project:
+    python -m benchmarks.bench_serialization [число_строк]
+"""
+import json
+import sqlite3
+import sys
+import time
+
+from api.serialization import dumps_bytes, map_rows
+from api.server import PRODUCT_ROW
+
+
+def row_get(row, key, default=None):
+    return row[key] if key in row.keys() else default
+
+
+def legacy_product(row):
+    return {
+        "id": row["id"],
+        "product_id": row_get(row, "product_id"),
+        "name": row_get(row, "product_name", row_get(row, "name")),
+        "category": row_get(row, "category"),
+        "price": row_get(row, "price"),
+        "cost": row_get(row, "cost"),
+        "description": row_get(row, "ingredients", row_get(row, "description")),
+        "seasonal": bool(row_get(row, "seasonal", 0)),
+        "active": bool(row_get(row, "active", 1)),
+        "introduced_date": row_get(row, "introduced_date"),
+        "stock": row_get(row, "stock", 0),
+    }
+
+
+def make_rows(n):
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    conn.execute(
+        "CREATE TABLE products (id INTEGER PRIMARY KEY, name TEXT, category TEXT, "
+        "price REAL, cost REAL, description TEXT, seasonal INTEGER, active INTEGER, "
+        "introduced_date TEXT, stock INTEGER)"
+    )
+    conn.executemany(
+        "INSERT INTO products VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [
+            (i, f"Product_{i}", "Bread", 2.5, 1.1, "Flour,Butter,Sugar", i % 2, 1, "2022-01-01", 50)
+            for i in range(n)
+        ],
+    )
+    return conn.execute("SELECT * FROM products").fetchall()
+
+
+def measure(fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main(n=10000):
+    rows = make_rows(n)
+
+    cases = [
+        ("row_get + json", lambda: json.dumps([legacy_product(r) for r in rows]).encode("utf-8")),
+        ("mapper + json", lambda: json.dumps(map_rows(rows, PRODUCT_ROW)).encode("utf-8")),
+        ("mapper + orjson", lambda: dumps_bytes(map_rows(rows, PRODUCT_ROW))),
+    ]
+
+    baseline = None
+    print(f"{n} rows, best of 5")
+    for name, fn in cases:
+        elapsed = measure(fn)
+        baseline = baseline or elapsed
+        print(f"  {name:<18} {elapsed * 1000:8.2f} ms  {n / elapsed:>12,.0f} rows/s  x{baseline / elapsed:.1f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -1,118 +1,362 @@
 import sqlite3
 import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
 
 DB_PATH = "bcl_app.sqlite"
 
-def get_connection():
-    conn = sqlite3.connect(DB_PATH)
+# --- Настройки пула соединений ---
+POOL_SIZE = int(os.environ.get("BCL_DB_POOL_SIZE", "8"))
+POOL_TIMEOUT = float(os.environ.get("BCL_DB_POOL_TIMEOUT", "10"))
+
+# Учёт времени SQLite на запрос API (см. start_db_timer): соединения
+# создаются с курсором TimedCursor, который замеряет сами вызовы
+# execute / executemany / fetch*. Время между вызовами (кодирование
+# строк при потоковой выдаче и т.п.) в него не попадает.
+DB_METRICS = os.environ.get("BCL_DB_METRICS", "1") != "0"
+
+# PRAGMA для соединений из пула (WAL + кэш страниц + mmap)
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -64000,          # ~64 MB (отрицательное значение = KiB)
+    "mmap_size": 268435456,        # 256 MB
+    "busy_timeout": 5000,          # мс
+    "temp_store": "MEMORY",
+}
+
+
+def get_connection(check_same_thread=True):
+    conn = sqlite3.connect(
+        DB_PATH, check_same_thread=check_same_thread, factory=_connection_factory()
+    )
     conn.row_factory = sqlite3.Row
     return conn
 
 
+def configure_connection(conn):
+    """Применяет PRAGMAS к уже открытому соединению."""
+    for name, value in PRAGMAS.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+
+# ----------------------- DB TIME PER REQUEST -----------------------
+
+_db_local = threading.local()
+
+
+def start_db_timer():
+    """Начинает учёт запросов SQLite текущего потока."""
+    _db_local.stats = {"queries": 0, "time": 0.0, "write_wait": 0.0}
+
+
+def stop_db_timer():
+    """Завершает учёт и возвращает {"queries", "time", "write_wait"} (или None)."""
+    stats = getattr(_db_local, "stats", None)
+    _db_local.stats = None
+    return stats
+
+
+def add_write_wait(seconds):
+    """Время ожидания потока-писателя (запись выполняется не в потоке запроса)."""
+    stats = getattr(_db_local, "stats", None)
+    if stats is not None:
+        stats["write_wait"] += seconds
+
+
+def _timed(name, query=False):
+    """Метод курсора, который добавляет время вызова к учёту потока (если он идёт)."""
+    base = getattr(sqlite3.Cursor, name)
+
+    def method(self, *args, **kwargs):
+        stats = getattr(_db_local, "stats", None)
+        if stats is None:
+            return base(self, *args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return base(self, *args, **kwargs)
+        finally:
+            stats["time"] += time.perf_counter() - started
+            if query:
+                stats["queries"] += 1
+
+    method.__name__ = name
+    return method
+
+
+class TimedCursor(sqlite3.Cursor):
+    execute = _timed("execute", query=True)
+    executemany = _timed("executemany", query=True)
+    fetchone = _timed("fetchone")
+    fetchmany = _timed("fetchmany")
+    fetchall = _timed("fetchall")
+
+
+class TimedConnection(sqlite3.Connection):
+    """
+    Соединение, курсоры которого — TimedCursor. Connection.execute()
+    в C создаёт обычный курсор, поэтому shortcut-методы переопределены.
+    """
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, parameters):
+        return self.cursor().executemany(sql, parameters)
+
+
+def _connection_factory():
+    return TimedConnection if DB_METRICS else sqlite3.Connection
+
+
+class ConnectionPool:
+    """
+    Ограниченный пул соединений SQLite.
+
+    Соединения создаются лениво (не более size штук), настраиваются через
+    configure_connection() и переиспользуются между запросами. Если все
+    соединения заняты, acquire() ждёт до timeout секунд.
+    """
+
+    def __init__(self, path=None, size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        self.path = path or DB_PATH
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._closed = False
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,        # выдано уже открытое соединение
+            "misses": 0,      # пришлось открыть новое соединение
+            "waits": 0,       # пул был исчерпан, ждали освобождения
+            "wait_time": 0.0, # суммарное время ожидания, сек
+            "timeouts": 0,    # ожидание не дождалось соединения
+        }
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, factory=_connection_factory())
+        conn.row_factory = sqlite3.Row
+        return configure_connection(conn)
+
+    def acquire(self):
+        if self._closed:
+            raise RuntimeError("connection pool is closed")
+
+        try:
+            conn = self._idle.get_nowait()
+            with self._lock:
+                self._stats["hits"] += 1
+            return conn
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_open = self._created < self.size
+            if can_open:
+                self._created += 1
+                self._stats["misses"] += 1
+            else:
+                self._stats["waits"] += 1
+
+        if can_open:
+            try:
+                return self._open()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        started = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            with self._lock:
+                self._stats["timeouts"] += 1
+            raise TimeoutError("no free database connection in pool")
+        finally:
+            with self._lock:
+                self._stats["wait_time"] += time.perf_counter() - started
+        return conn
+
+    def release(self, conn):
+        # Незавершённая транзакция не должна «утечь» к следующему запросу
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self.discard(conn)
+            return
+        if self._closed:
+            conn.close()
+            with self._lock:
+                self._created -= 1
+            return
+        self._idle.put(conn)
+
+    def discard(self, conn):
+        """Закрывает сломанное соединение вместо возврата в пул."""
+        try:
+            conn.close()
+        finally:
+            with self._lock:
+                self._created -= 1
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data["size"] = self.size
+            data["open"] = self._created
+        data["idle"] = self._idle.qsize()
+        data["in_use"] = data["open"] - data["idle"]
+        total = data["hits"] + data["misses"]
+        data["hit_rate"] = round(data["hits"] / total, 4) if total else 0.0
+        return data
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self.discard(conn)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Возвращает общий пул процесса (создаётся при первом обращении)."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+
+def pooled_connection():
+    """
+    Контекстный менеджер для обработчиков API:
+
+        with pooled_connection() as conn:
+            conn.execute(...)
+    """
+    return get_pool().connection()
+
+
+def pool_stats():
+    return get_pool().stats()
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+# Пулы, унаследованные через fork: ссылки держим, чтобы сборщик мусора
+# не закрыл в дочернем процессе соединения SQLite, открытые родителем
+_inherited_pools = []
+
+
+def _reset_pool_after_fork():
+    """
+    В дочернем процессе (воркер gunicorn и т.п.) у каждого воркера свой
+    пул. Соединения родителя не используются и не закрываются; лучше,
+    чтобы родитель пул вообще не открывал (gunicorn.conf.py, wsgi.py).
+    """
+    global _pool, _pool_lock
+    if _pool is not None:
+        _inherited_pools.append(_pool)
+    _pool = None
+    _pool_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_pool_after_fork)
+
+
+# ----------------------- INIT LOCK -----------------------
+
+@contextmanager
+def init_lock():
+    """
+    Межпроцессная блокировка инициализации базы (файл рядом с базой).
+
+    Воркеры uvicorn импортируют приложение одновременно, и каждый
+    вызывает init_db: миграции и импорт CSV должны выполниться одним
+    процессом, остальные ждут и затем видят уже готовую базу.
+    """
+    with open(DB_PATH + ".init.lock", "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK сдаётся после ~10 секунд ожидания
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
 def init_db():
+    with init_lock():
+        _init_db()
+
+
+def _init_db():
+    from .migrations import migrate
+
     conn = get_connection()
-    cur = conn.cursor()
-
-    # ----------------------- USERS -----------------------
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            email TEXT UNIQUE,
-            password_hash TEXT,
-            first_name TEXT,
-            last_name TEXT,
-            phone TEXT,
-            mailing_list INTEGER DEFAULT 0,
-            preferred_delivery TEXT,
-            profile_image TEXT,
-            secret_question TEXT,
-            secret_answer_hash TEXT
-        );
-    """)
-
-    # ----------------------- PRODUCTS -----------------------
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS products (
-            id INTEGER PRIMARY KEY,
-            name TEXT,
-            category TEXT,
-            price REAL,
-            cost REAL,
-            description TEXT,
-            seasonal INTEGER,
-            active INTEGER,
-            introduced_date TEXT,
-            stock INTEGER DEFAULT 50
-        );
-    """)
-
-    # ----------------------- CUSTOMERS -----------------------
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS customers (
-            id INTEGER PRIMARY KEY,
-            first_name TEXT,
-            last_name TEXT,
-            email TEXT,
-            phone TEXT,
-            membership TEXT,
-            total_spending REAL
-        );
-    """)
-
-    # ----------------------- ORDERS -----------------------
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS orders (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            customer_id INTEGER,
-            order_date TEXT,
-            total_amount REAL,
-            status TEXT DEFAULT 'Pending'
-        );
-    """)
-
-    # ----------------------- ORDER ITEMS -----------------------
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS order_items (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            order_id INTEGER,
-            product_id INTEGER,
-            quantity INTEGER,
-            unit_price REAL
-        );
-    """)
-
-    # ----------------------- PROMOTIONS -----------------------
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS promotions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT,
-            discount_type TEXT,
-            discount_value REAL,
-            start_date TEXT,
-            end_date TEXT,
-            min_order_value REAL,
-            priority INTEGER
-        );
-    """)
-
-    # ----------------------- LOYALTY -----------------------
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS loyalty (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            customer_id INTEGER UNIQUE,
-            points INTEGER DEFAULT 0
-        );
-    """)
-
-    conn.commit()
+    applied = migrate(conn)
     conn.close()
 
+    if applied:
+        print("Database schema migrated to version", applied[-1])
     print("Database schema initialized.")
 
     # ----------------------- LOAD CLEANED CSV -----------------------
     try:
         from .seed_data import seed_from_csv
-        seed_from_csv()
-        print("Cleaned CSV imported into the DB.")
+        seeded = seed_from_csv()
+        if seeded:
+            print("Cleaned CSV imported into the DB:", seeded)
+        else:
+            print("Cleaned CSV unchanged, import skipped.")
     except Exception as e:
         print("Failed to load cleaned CSV:", e)
@@ -0,0 +1,414 @@
+import sqlite3
+
+# ======================================================================
+# Версионированные миграции схемы.
+#
+# Каждая миграция — (version, description, step), где step либо строка
+# SQL (выполняется по одной инструкции), либо функция step(conn).
+# Применённые версии записываются в таблицу schema_version, поэтому
+# каждая миграция выполняется ровно один раз.
+# ======================================================================
+
+
+BASE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        email TEXT UNIQUE,
+        password_hash TEXT,
+        first_name TEXT,
+        last_name TEXT,
+        phone TEXT,
+        mailing_list INTEGER DEFAULT 0,
+        preferred_delivery TEXT,
+        profile_image TEXT,
+        secret_question TEXT,
+        secret_answer_hash TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS products (
+        id INTEGER PRIMARY KEY,
+        name TEXT,
+        category TEXT,
+        price REAL,
+        cost REAL,
+        description TEXT,
+        seasonal INTEGER,
+        active INTEGER,
+        introduced_date TEXT,
+        stock INTEGER DEFAULT 50
+    );
+
+    CREATE TABLE IF NOT EXISTS customers (
+        id INTEGER PRIMARY KEY,
+        first_name TEXT,
+        last_name TEXT,
+        email TEXT,
+        phone TEXT,
+        membership TEXT,
+        total_spending REAL
+    );
+
+    CREATE TABLE IF NOT EXISTS orders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        customer_id INTEGER,
+        order_date TEXT,
+        total_amount REAL,
+        status TEXT DEFAULT 'Pending'
+    );
+
+    CREATE TABLE IF NOT EXISTS order_items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        order_id INTEGER,
+        product_id INTEGER,
+        quantity INTEGER,
+        unit_price REAL
+    );
+
+    CREATE TABLE IF NOT EXISTS promotions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT,
+        discount_type TEXT,
+        discount_value REAL,
+        start_date TEXT,
+        end_date TEXT,
+        min_order_value REAL,
+        priority INTEGER
+    );
+
+    CREATE TABLE IF NOT EXISTS loyalty (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        customer_id INTEGER UNIQUE,
+        points INTEGER DEFAULT 0
+    );
+"""
+
+
+# Вторичные индексы: (имя, таблица, DDL). Список вынесен отдельно, чтобы
+# массовый импорт мог временно удалить индексы и пересоздать их после.
+INDEXES = [
+    ("idx_orders_customer", "orders",
+     "CREATE INDEX IF NOT EXISTS idx_orders_customer "
+     "ON orders(customer_id, order_date, status, total_amount)"),
+    ("idx_orders_status_date", "orders",
+     "CREATE INDEX IF NOT EXISTS idx_orders_status_date "
+     "ON orders(status, order_date)"),
+    ("idx_orders_order_date", "orders",
+     "CREATE INDEX IF NOT EXISTS idx_orders_order_date "
+     "ON orders(order_date)"),
+    # Покрывающий индекс для get_order / cancel_order: позиции заказа
+    # читаются целиком из индекса, без обращения к таблице
+    ("idx_order_items_order", "order_items",
+     "CREATE INDEX IF NOT EXISTS idx_order_items_order "
+     "ON order_items(order_id, product_id, quantity, unit_price)"),
+    ("idx_order_items_product", "order_items",
+     "CREATE INDEX IF NOT EXISTS idx_order_items_product "
+     "ON order_items(product_id)"),
+    ("idx_products_category", "products",
+     "CREATE INDEX IF NOT EXISTS idx_products_category "
+     "ON products(category)"),
+]
+
+
+def _column_names(conn, table):
+    return {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def _ensure_products_stock(conn):
+    """Старые базы (schema.sql) создавались без колонки products.stock."""
+    if "stock" not in _column_names(conn, "products"):
+        conn.execute("ALTER TABLE products ADD COLUMN stock INTEGER DEFAULT 50")
+
+
+def create_indexes(conn, tables=None):
+    """Создаёт индексы из INDEXES (все или только для указанных таблиц)."""
+    for name, table, ddl in INDEXES:
+        if tables is None or table in tables:
+            conn.execute(ddl)
+
+
+def drop_indexes(conn, tables=None):
+    for name, table, _ddl in INDEXES:
+        if tables is None or table in tables:
+            conn.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+SEED_FINGERPRINTS = """
+    CREATE TABLE IF NOT EXISTS seed_fingerprints (
+        label TEXT PRIMARY KEY,
+        path TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        mtime REAL NOT NULL,
+        sha256 TEXT NOT NULL,
+        rows INTEGER NOT NULL DEFAULT 0,
+        seeded_at TEXT DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+
+
+# Таблицы, для которых ведётся счётчик изменений (ETag / Last-Modified)
+VERSIONED_TABLES = ["products", "customers", "orders", "order_items", "promotions", "loyalty"]
+
+
+def _create_table_versions(conn):
+    """
+    table_versions: монотонный счётчик изменений на таблицу.
+    Триггеры увеличивают его при любом INSERT / UPDATE / DELETE,
+    независимо от того, кто пишет (API, импорт CSV, ручные правки).
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS table_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0,
+            updated_at REAL NOT NULL DEFAULT 0
+        )
+        """
+    )
+    for table in VERSIONED_TABLES:
+        conn.execute(
+            "INSERT OR IGNORE INTO table_versions(name, version, updated_at) "
+            "VALUES (?, 1, (julianday('now') - 2440587.5) * 86400.0)",
+            (table,),
+        )
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            conn.execute(
+                f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_version
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE table_versions
+                    SET version = version + 1,
+                        updated_at = (julianday('now') - 2440587.5) * 86400.0
+                    WHERE name = '{table}';
+                END
+                """
+            )
+
+
+IDEMPOTENCY_KEYS = """
+    CREATE TABLE IF NOT EXISTS idempotency_keys (
+        key TEXT PRIMARY KEY,
+        request_hash TEXT NOT NULL,
+        status INTEGER NOT NULL,
+        body BLOB NOT NULL,
+        created_at REAL NOT NULL,
+        expires_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires
+        ON idempotency_keys(expires_at);
+"""
+
+
+# Таблицы с построчными версиями для дельта-синхронизации: таблица -> ключ строки.
+# Для loyalty ключ — customer_id: API адресует баллы по клиенту.
+ROW_VERSIONED_TABLES = {
+    "products": "id",
+    "customers": "id",
+    "orders": "id",
+    "loyalty": "customer_id",
+}
+
+
+def _create_row_changes(conn):
+    """
+    row_changes: последняя версия каждой строки (и отметка удаления).
+    Версия — монотонный счётчик внутри таблицы; триггеры записывают её
+    при любом INSERT / UPDATE / DELETE, поэтому клиент по ?since=<version>
+    получает только изменённые и удалённые с тех пор строки.
+    Существующие строки получают версию 1.
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS row_changes (
+            tbl TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            version INTEGER NOT NULL,
+            deleted INTEGER NOT NULL DEFAULT 0,
+            changed_at REAL NOT NULL,
+            PRIMARY KEY (tbl, row_id)
+        )
+        """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_row_changes_version ON row_changes(tbl, version)"
+    )
+    for table, key in ROW_VERSIONED_TABLES.items():
+        conn.execute(
+            f"""
+            INSERT OR IGNORE INTO row_changes(tbl, row_id, version, deleted, changed_at)
+            SELECT '{table}', {key}, 1, 0, {_NOW} FROM {table} WHERE {key} IS NOT NULL
+            """
+        )
+    _create_row_change_triggers(conn)
+
+
+_NOW = "(julianday('now') - 2440587.5) * 86400.0"
+
+
+def _create_row_change_triggers(conn):
+    """
+    Триггеры row_changes. Запись — UPSERT, а не INSERT OR REPLACE:
+    политика конфликта внешней инструкции (ON CONFLICT ... DO UPDATE в
+    /api/loyalty, массовом импорте продуктов) переопределяет OR REPLACE
+    внутри триггера, и повторная запись строки падала на UNIQUE.
+    """
+    for table, key in ROW_VERSIONED_TABLES.items():
+        next_version = (
+            f"(SELECT COALESCE(MAX(version), 0) + 1 FROM row_changes WHERE tbl = '{table}')"
+        )
+        triggers = [
+            (f"trg_{table}_{event.lower()}_row", event, f"{ref}.{key} IS NOT NULL", f"{ref}.{key}", deleted)
+            for event, ref, deleted in (("INSERT", "NEW", 0), ("UPDATE", "NEW", 0), ("DELETE", "OLD", 1))
+        ]
+        # Смена ключа строки: для старого ключа клиент должен увидеть удаление
+        triggers.append((
+            f"trg_{table}_rekey_row", f"UPDATE OF {key}",
+            f"OLD.{key} IS NOT NULL AND OLD.{key} IS NOT NEW.{key}", f"OLD.{key}", 1,
+        ))
+        for name, event, when, row_id, deleted in triggers:
+            conn.execute(
+                f"""
+                CREATE TRIGGER IF NOT EXISTS {name}
+                AFTER {event} ON {table}
+                WHEN {when}
+                BEGIN
+                    INSERT INTO row_changes(tbl, row_id, version, deleted, changed_at)
+                    VALUES ('{table}', {row_id}, {next_version}, {deleted}, {_NOW})
+                    ON CONFLICT(tbl, row_id) DO UPDATE SET
+                        version = excluded.version,
+                        deleted = excluded.deleted,
+                        changed_at = excluded.changed_at;
+                END
+                """
+            )
+
+
+def _recreate_row_change_triggers(conn):
+    """Триггеры row_changes из миграции 7 (INSERT OR REPLACE) заменяются на UPSERT."""
+    for table in ROW_VERSIONED_TABLES:
+        for event in ("insert", "update", "delete", "rekey"):
+            conn.execute(f"DROP TRIGGER IF EXISTS trg_{table}_{event}_row")
+    _create_row_change_triggers(conn)
+
+
+def _add_transaction_ids(conn):
+    """
+    Номер транзакции из sales CSV хранится в отдельной колонке с UNIQUE:
+    id заказов и позиций выделяет AUTOINCREMENT, общий с API, поэтому
+    импорт больше не пишет CSV-номер в id и не затирает строки API.
+    Уже загруженные строки импорт создавал с id = transaction_id
+    (и позиция с id = order_id) — для них номер переносится в новую колонку.
+    """
+    for table in ("orders", "order_items"):
+        if "transaction_id" not in _column_names(conn, table):
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN transaction_id INTEGER")
+    conn.execute(
+        "UPDATE order_items SET transaction_id = id "
+        "WHERE id = order_id AND transaction_id IS NULL"
+    )
+    conn.execute(
+        "UPDATE orders SET transaction_id = id WHERE transaction_id IS NULL "
+        "AND id IN (SELECT transaction_id FROM order_items WHERE transaction_id IS NOT NULL)"
+    )
+    # Не входят в INDEXES: массовый импорт опирается на них в ON CONFLICT
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_orders_transaction ON orders(transaction_id)"
+    )
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_order_items_transaction "
+        "ON order_items(transaction_id)"
+    )
+
+
+SHARED_SESSION_STATE = """
+    CREATE TABLE IF NOT EXISTS app_secrets (
+        name TEXT PRIMARY KEY,
+        value BLOB NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS revoked_tokens (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        jti TEXT NOT NULL UNIQUE,
+        expires_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_revoked_tokens_expires
+        ON revoked_tokens(expires_at);
+"""
+
+
+MIGRATIONS = [
+    (1, "base schema", BASE_SCHEMA),
+    (2, "products.stock column", _ensure_products_stock),
+    (3, "secondary and covering indexes", create_indexes),
+    (4, "seed file fingerprints", SEED_FINGERPRINTS),
+    (5, "per-table change counters", _create_table_versions),
+    (6, "idempotency keys", IDEMPOTENCY_KEYS),
+    (7, "per-row versions for delta sync", _create_row_changes),
+    (8, "sales transaction ids separate from order ids", _add_transaction_ids),
+    (9, "session secret and revoked tokens shared by workers", SHARED_SESSION_STATE),
+    # Секрет подписи переехал в файл рядом с базой (api/server.py,
+    # SESSION_SECRET_PATH): база лежит в git, ключ в ней хранить нельзя
+    (10, "session secret moved out of the database", "DROP TABLE IF EXISTS app_secrets"),
+    (11, "row_changes triggers compatible with UPSERT", _recreate_row_change_triggers),
+]
+
+
+def current_version(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def migrate(conn):
+    """
+    Применяет все миграции новее текущей версии, каждую в своей транзакции.
+    Возвращает список применённых версий.
+
+    Миграцию могут одновременно запускать несколько процессов (воркеры
+    uvicorn и т.п.): транзакция открывается сразу на запись (BEGIN
+    IMMEDIATE), и версия перечитывается уже под этой блокировкой —
+    шаг, применённый другим процессом, пропускается.
+    """
+    applied = []
+    version = current_version(conn)
+    conn.commit()
+
+    for number, description, step in MIGRATIONS:
+        if number <= version:
+            continue
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            version = current_version(conn)
+            if number <= version:
+                conn.commit()
+                continue
+            if callable(step):
+                step(conn)
+            else:
+                for statement in step.split(";"):
+                    if statement.strip():
+                        conn.execute(statement)
+            conn.execute(
+                "INSERT INTO schema_version(version, description) VALUES (?, ?)",
+                (number, description),
+            )
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        applied.append(number)
+
+    # Обновляем статистику планировщика: после новых индексов — полный
+    # ANALYZE, иначе достаточно дешёвого PRAGMA optimize
+    if applied:
+        conn.execute("ANALYZE")
+    conn.execute("PRAGMA optimize")
+    conn.commit()
+    return applied
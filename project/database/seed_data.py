@@ -1,56 +1,280 @@
 import pandas as pd
+import hashlib
 import os
-from .connection import get_connection
+import time
+from .connection import get_connection, configure_connection
+from .migrations import create_indexes, drop_indexes
 
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
 OUTPUT_DIR = os.path.join(BASE_DIR, "output_session1")
 
-def seed_from_csv():
-    conn = get_connection()
-    cur = conn.cursor()
-
-    products_csv  = os.path.join(OUTPUT_DIR, "products_cleaned.csv")
-    customers_csv = os.path.join(OUTPUT_DIR, "customers_cleaned.csv")
-    sales_csv     = os.path.join(OUTPUT_DIR, "sales_transactions_cleaned.csv")
-
-    # ---------- PRODUCTS ----------
-    if os.path.exists(products_csv):
-        df = pd.read_csv(products_csv)
-        for _, row in df.iterrows():
-            cur.execute("""
-                INSERT OR REPLACE INTO products
-                (id, name, category, price, cost, description, seasonal, active, introduced_date, stock)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                int(row["product_id"]),
-                row.get("product_name", ""),
-                row.get("category", ""),
-                float(row.get("price", 0)),
-                float(row.get("cost", 0)),
-                row.get("ingredients", ""),
-                int(row.get("seasonal", 0)),
-                int(row.get("active", 1)),
-                str(row.get("introduced_date", "")),
-                int(row.get("stock", 50)),
-            ))
-
-    # ---------- CUSTOMERS ----------
-    if os.path.exists(customers_csv):
-        df = pd.read_csv(customers_csv)
-        for _, row in df.iterrows():
-            cur.execute("""
-                INSERT OR REPLACE INTO customers
-                (id, first_name, last_name, email, phone, membership, total_spending)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (
-                int(row["customer_id"]),
-                row.get("first_name", ""),
-                row.get("last_name", ""),
-                row.get("email", ""),
-                row.get("phone_number", ""),
-                row.get("membership_status", "Basic"),
-                float(row.get("total_spent", 0)),
-            ))
+# Сколько строк CSV читается и вставляется за одну транзакцию
+CHUNK_SIZE = 50000
+HASH_BLOCK_SIZE = 1024 * 1024
 
+
+# Описание колонок: (колонка в БД, колонка в CSV или None, тип, значение по умолчанию
+# [, SQL-выражение вместо плейсхолдера "?"]).
+# Если колонки нет в CSV (или source = None), подставляется значение по умолчанию.
+PRODUCT_COLUMNS = [
+    ("id", "product_id", int, 0),
+    ("name", "product_name", str, ""),
+    ("category", "category", str, ""),
+    ("price", "price", float, 0.0),
+    ("cost", "cost", float, 0.0),
+    ("description", "ingredients", str, ""),
+    ("seasonal", "seasonal", int, 0),
+    ("active", "active", int, 1),
+    ("introduced_date", "introduced_date", str, ""),
+    ("stock", "stock", int, 50),
+]
+
+CUSTOMER_COLUMNS = [
+    ("id", "customer_id", int, 0),
+    ("first_name", "first_name", str, ""),
+    ("last_name", "last_name", str, ""),
+    ("email", "email", str, ""),
+    ("phone", "phone_number", str, ""),
+    ("membership", "membership_status", str, "Basic"),
+    ("total_spending", "total_spending", float, 0.0),
+]
+
+# Одна строка sales_transactions = один заказ с одной позицией.
+# id заказов и позиций выделяет AUTOINCREMENT (общий с API), номер
+# транзакции хранится в transaction_id (UNIQUE, миграция 8)
+ORDER_COLUMNS = [
+    ("transaction_id", "transaction_id", int, 0),
+    ("customer_id", "customer_id", int, 0),
+    ("order_date", "date", str, ""),
+    ("total_amount", "total_amount", float, 0.0),
+    ("status", None, str, "Completed"),
+]
+
+ORDER_ITEM_COLUMNS = [
+    ("transaction_id", "transaction_id", int, 0),
+    ("order_id", "transaction_id", int, 0, "(SELECT id FROM orders WHERE transaction_id = ?)"),
+    ("product_id", "product_id", int, 0),
+    ("quantity", "quantity", int, 0),
+    ("unit_price", "price", float, 0.0),
+]
+
+
+def _prepare_sales(chunk):
+    chunk["total_amount"] = chunk["quantity"] * chunk["price"]
+    return chunk
+
+
+# label -> (имя файла, [(таблица, колонки, ключ CSV), ...], подготовка чанка).
+# Ключ CSV None: строка с тем же id заменяется (справочники из CSV);
+# иначе уже загруженная строка с тем же ключом не трогается, а id
+# выделяет БД — так импорт не затирает заказы, созданные или
+# изменённые через API.
+SEED_FILES = {
+    "products": ("products_cleaned.csv", [("products", PRODUCT_COLUMNS, None)], None),
+    "customers": ("customers_cleaned.csv", [("customers", CUSTOMER_COLUMNS, None)], None),
+    "sales": (
+        "sales_transactions_cleaned.csv",
+        [
+            ("orders", ORDER_COLUMNS, "transaction_id"),
+            ("order_items", ORDER_ITEM_COLUMNS, "transaction_id"),
+        ],
+        _prepare_sales,
+    ),
+}
+
+
+def _column_values(chunk, source, kind, default):
+    """Значения одной колонки чанка как список Python-объектов (без Series на строку)."""
+    if source is None or source not in chunk.columns:
+        return [default] * len(chunk)
+
+    series = chunk[source]
+    if kind is int:
+        return pd.to_numeric(series, errors="coerce").fillna(default).astype("int64").tolist()
+    if kind is float:
+        return pd.to_numeric(series, errors="coerce").fillna(default).astype(float).tolist()
+    return series.fillna(default).astype(str).tolist()
+
+
+def chunk_to_tuples(chunk, columns):
+    values = [_column_values(chunk, c[1], c[2], c[3]) for c in columns]
+    return list(zip(*values))
+
+
+def _insert_sql(table, columns, key=None):
+    names = ", ".join(c[0] for c in columns)
+    marks = ", ".join(c[4] if len(c) > 4 else "?" for c in columns)
+    if key is None:
+        return f"INSERT OR REPLACE INTO {table} ({names}) VALUES ({marks})"
+    return f"INSERT INTO {table} ({names}) VALUES ({marks}) ON CONFLICT({key}) DO NOTHING"
+
+
+def load_csv(conn, label, path, targets, prepare=None, chunk_size=CHUNK_SIZE, skip_rows=0):
+    """
+    Потоково загружает CSV: читает по chunk_size строк, каждый чанк
+    вставляется через executemany в одной транзакции.
+    skip_rows — сколько строк данных (после заголовка) пропустить.
+    Возвращает число загруженных строк CSV.
+    """
+    statements = [(_insert_sql(table, columns, key), columns) for table, columns, key in targets]
+    total = 0
+    started = time.perf_counter()
+    skiprows = range(1, skip_rows + 1) if skip_rows else None
+
+    for chunk in pd.read_csv(path, chunksize=chunk_size, skiprows=skiprows):
+        if prepare is not None:
+            chunk = prepare(chunk)
+
+        conn.execute("BEGIN")
+        try:
+            for sql, columns in statements:
+                conn.executemany(sql, chunk_to_tuples(chunk, columns))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        total += len(chunk)
+        elapsed = time.perf_counter() - started
+        rate = total / elapsed if elapsed > 0 else 0
+        print(f"  {label}: {total} rows ({rate:,.0f} rows/s)")
+
+    return total
+
+
+# ----------------------- FINGERPRINTS -----------------------
+
+def file_fingerprint(path, prefix_size=None):
+    """
+    Возвращает (sha256 всего файла, sha256 первых prefix_size байт).
+    Оба хеша считаются за один проход по файлу.
+    """
+    full = hashlib.sha256()
+    prefix_digest = None
+    read = 0
+
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            if prefix_size is not None and read < prefix_size <= read + len(block):
+                head = full.copy()
+                head.update(block[:prefix_size - read])
+                prefix_digest = head.hexdigest()
+            full.update(block)
+            read += len(block)
+
+    if prefix_size == 0:
+        prefix_digest = hashlib.sha256().hexdigest()
+    return full.hexdigest(), prefix_digest
+
+
+def _ends_with_newline(path, size):
+    with open(path, "rb") as f:
+        f.seek(size - 1)
+        return f.read(1) == b"\n"
+
+
+def _save_fingerprint(conn, label, path, stat, digest, rows):
+    conn.execute(
+        """
+        INSERT INTO seed_fingerprints(label, path, size, mtime, sha256, rows, seeded_at)
+        VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(label) DO UPDATE SET
+            path = excluded.path, size = excluded.size, mtime = excluded.mtime,
+            sha256 = excluded.sha256, rows = excluded.rows, seeded_at = excluded.seeded_at
+        """,
+        (label, path, stat.st_size, stat.st_mtime, digest, rows),
+    )
     conn.commit()
-    conn.close()
+
+
+def plan_seed(conn, label, path):
+    """
+    Сравнивает файл с сохранённым отпечатком и решает, что делать:
+        ("skip", rows, digest)   — файл не изменился;
+        ("append", rows, digest) — к файлу только дописали строки, грузим хвост;
+        ("full", 0, digest)      — файл новый или изменён, полный импорт.
+    """
+    stat = os.stat(path)
+    prev = conn.execute(
+        "SELECT size, mtime, sha256, rows FROM seed_fingerprints WHERE label = ?",
+        (label,),
+    ).fetchone()
+
+    # Быстрый путь: размер и mtime совпали — файл даже не читаем
+    if prev and prev["size"] == stat.st_size and prev["mtime"] == stat.st_mtime:
+        return "skip", prev["rows"], prev["sha256"]
+
+    appended = (
+        prev is not None
+        and 0 < prev["size"] < stat.st_size
+        and _ends_with_newline(path, prev["size"])
+    )
+    digest, prefix_digest = file_fingerprint(path, prev["size"] if appended else None)
+
+    if prev and digest == prev["sha256"]:
+        # Содержимое то же (файл «потрогали») — запоминаем новый mtime
+        conn.execute(
+            "UPDATE seed_fingerprints SET mtime = ? WHERE label = ?",
+            (stat.st_mtime, label),
+        )
+        conn.commit()
+        return "skip", prev["rows"], digest
+    if appended and prefix_digest == prev["sha256"]:
+        return "append", prev["rows"], digest
+    return "full", 0, digest
+
+
+def seed_from_csv(labels=None, force=False):
+    """
+    Импортирует очищенные CSV из output_session1.
+
+    Для каждого файла хранится отпечаток (размер, mtime, sha256) в
+    seed_fingerprints: неизменённые файлы пропускаются, к дописанным
+    файлам догружаются только новые строки, остальные импортируются
+    целиком. При полном импорте вторичные индексы таблиц удаляются на
+    время загрузки и пересоздаются после неё.
+    Возвращает {label: число загруженных строк} только для загруженных файлов.
+    """
+    conn = configure_connection(get_connection())
+    result = {}
+
+    try:
+        for label, (filename, targets, prepare) in SEED_FILES.items():
+            if labels is not None and label not in labels:
+                continue
+            path = os.path.join(OUTPUT_DIR, filename)
+            if not os.path.exists(path):
+                continue
+
+            action, done_rows, digest = plan_seed(conn, label, path)
+            if force:
+                action, done_rows = "full", 0
+            if action == "skip":
+                continue
+
+            stat = os.stat(path)
+            if action == "append":
+                loaded = load_csv(conn, label, path, targets, prepare, skip_rows=done_rows)
+            else:
+                tables = [table for table, *_ in targets]
+                drop_indexes(conn, tables)
+                conn.commit()
+                try:
+                    loaded = load_csv(conn, label, path, targets, prepare)
+                finally:
+                    create_indexes(conn, tables)
+                    conn.commit()
+
+            _save_fingerprint(conn, label, path, stat, digest, done_rows + loaded)
+            result[label] = loaded
+
+        if result:
+            conn.execute("ANALYZE")
+            conn.commit()
+    finally:
+        conn.close()
+
+    return result
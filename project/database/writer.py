@@ -0,0 +1,277 @@
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from . import connection
+from .connection import add_write_wait, configure_connection
+
+# ======================================================================
+# Единственный поток-писатель с групповым коммитом.
+#
+# Обработчики API не открывают транзакции сами, а отправляют задания
+# (функции job(conn) -> result) в очередь. Поток-писатель забирает
+# сразу несколько заданий, выполняет их в одной транзакции
+# BEGIN IMMEDIATE ... COMMIT (один fsync на пачку) и возвращает
+# результаты / исключения ожидающим обработчикам через Future.
+# Каждое задание выполняется внутри SAVEPOINT, поэтому ошибка одного
+# задания откатывает только его изменения, а не всю пачку.
+#
+# Задания НЕ должны вызывать conn.commit() / conn.rollback().
+# ======================================================================
+
+MAX_BATCH = 64          # максимум заданий в одной транзакции
+GROUP_WINDOW = 0.002    # сколько ждать попутные задания, сек
+SUBMIT_TIMEOUT = 30     # сколько обработчик ждёт результат, сек
+
+_STOP = object()
+
+
+class WriterStopped(RuntimeError):
+    """Задание поставлено после stop(): писатель его уже не выполнит."""
+
+
+class DatabaseWriter:
+    def __init__(self, path=None, max_batch=MAX_BATCH, group_window=GROUP_WINDOW):
+        self.path = path or connection.DB_PATH
+        self.max_batch = max_batch
+        self.group_window = group_window
+        self._queue = queue.Queue()
+        self._thread = None
+        self._stopped = False
+        self._lock = threading.Lock()
+        self._stats = {"jobs": 0, "failed": 0, "batches": 0, "max_batch": 0}
+
+    # ------------------------------------------------------------------
+    def start(self):
+        with self._lock:
+            self._stopped = False
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="db-writer", daemon=True
+                )
+                self._thread.start()
+        return self
+
+    def stop(self, timeout=5):
+        """
+        Выполняет задания, поставленные до вызова, и останавливает поток.
+        Задания, поставленные после, сразу завершаются с WriterStopped.
+        """
+        with self._lock:
+            self._stopped = True
+            thread = self._thread
+            if thread is not None and thread.is_alive():
+                self._queue.put(_STOP)
+        if thread is not None:
+            thread.join(timeout)
+        if thread is None or not thread.is_alive():
+            self._fail_queued()
+        self._thread = None
+
+    def submit(self, job, *args, **kwargs):
+        """Ставит задание в очередь, возвращает Future с результатом job(conn, ...)."""
+        if self._thread is None and not self._stopped:
+            self.start()
+        future = Future()
+        with self._lock:
+            # Проверка и постановка под одной блокировкой с stop(): задание
+            # либо попадает в очередь до _STOP, либо сразу отклоняется
+            if self._stopped:
+                future.set_exception(WriterStopped("database writer is stopped"))
+                return future
+            self._queue.put((future, job, args, kwargs))
+        return future
+
+    def execute(self, job, *args, **kwargs):
+        """
+        Как submit(), но ждёт результат (или пробрасывает исключение задания).
+        По истечении SUBMIT_TIMEOUT задание снимается с очереди; если писатель
+        уже начал его выполнять, ждём настоящий исход — иначе обработчик
+        ответил бы ошибкой на запись, которая всё-таки будет закоммичена.
+        """
+        future = self.submit(job, *args, **kwargs)
+        try:
+            return future.result(timeout=SUBMIT_TIMEOUT)
+        except FutureTimeout:
+            if future.cancel():
+                raise
+            return future.result()
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+        data["queued"] = self._queue.qsize()
+        data["avg_batch"] = round(data["jobs"] / data["batches"], 2) if data["batches"] else 0.0
+        return data
+
+    # ------------------------------------------------------------------
+    def _open(self):
+        # isolation_level=None: транзакциями управляем вручную
+        conn = sqlite3.connect(self.path, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return configure_connection(conn)
+
+    def _fail_queued(self):
+        """Завершает с WriterStopped задания, оставшиеся в очереди."""
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not _STOP and item[0].set_running_or_notify_cancel():
+                item[0].set_exception(WriterStopped("database writer is stopped"))
+
+    def _next_batch(self):
+        """
+        Блокируется до первого задания, затем добирает попутные. Окно
+        group_window отсчитывается от первого задания: при плотном потоке
+        заданий оно не продлевается с каждым новым.
+        """
+        first = self._queue.get()
+        if first is _STOP:
+            return [], True
+
+        batch = [first]
+        deadline = time.monotonic() + self.group_window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    item = self._queue.get(timeout=remaining)
+                else:
+                    # Окно истекло: забираем только то, что уже в очереди
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        conn = self._open()
+        try:
+            while True:
+                batch, stop = self._next_batch()
+                if batch:
+                    try:
+                        self._run_batch(conn, batch)
+                    except Exception as e:
+                        # Поток-писатель не должен умирать: отдаём ошибку ждущим
+                        if conn.in_transaction:
+                            conn.execute("ROLLBACK")
+                        for future, *_ in batch:
+                            if not future.done():
+                                future.set_exception(e)
+                if stop:
+                    break
+        finally:
+            conn.close()
+
+    def _run_batch(self, conn, batch):
+        done = []
+        failed = 0
+
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.Error as e:
+            for future, *_ in batch:
+                future.set_exception(e)
+            with self._lock:
+                self._stats["failed"] += len(batch)
+            return
+
+        for future, job, args, kwargs in batch:
+            if not future.set_running_or_notify_cancel():
+                continue
+            conn.execute("SAVEPOINT job")
+            try:
+                result = job(conn, *args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+                failed += 1
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK TO job")
+                    conn.execute("RELEASE job")
+                else:
+                    # SQLite откатил транзакцию целиком — задания до этого тоже потеряны
+                    for lost, _ in done:
+                        lost.set_exception(e)
+                    failed += len(done)
+                    done = []
+                    conn.execute("BEGIN IMMEDIATE")
+            else:
+                conn.execute("RELEASE job")
+                done.append((future, result))
+
+        try:
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for future, _ in done:
+                future.set_exception(e)
+            failed += len(done)
+            done = []
+
+        # Результаты отдаём только после успешного COMMIT
+        for future, result in done:
+            future.set_result(result)
+
+        with self._lock:
+            self._stats["jobs"] += len(batch)
+            self._stats["failed"] += failed
+            self._stats["batches"] += 1
+            self._stats["max_batch"] = max(self._stats["max_batch"], len(batch))
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """Общий поток-писатель процесса (запускается при первом обращении)."""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = DatabaseWriter().start()
+                atexit.register(_writer.stop)
+    return _writer
+
+
+def run_write(job, *args, **kwargs):
+    """Выполняет job(conn, ...) в потоке-писателе и возвращает результат."""
+    started = time.perf_counter()
+    try:
+        return get_writer().execute(job, *args, **kwargs)
+    finally:
+        add_write_wait(time.perf_counter() - started)
+
+
+def writer_stats():
+    return get_writer().stats()
+
+
+def stop_writer():
+    """Дожидается выполнения уже поставленных заданий и останавливает поток."""
+    global _writer
+    with _writer_lock:
+        if _writer is not None:
+            _writer.stop()
+            _writer = None
+
+
+def _reset_writer_after_fork():
+    # Поток-писатель родителя в дочернем процессе не существует
+    global _writer, _writer_lock
+    _writer = None
+    _writer_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_writer_after_fork)
@@ -0,0 +1,56 @@
+"""
+Конфигурация gunicorn для API.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Настройки через переменные окружения:
+    BCL_BIND       адрес (по умолчанию 127.0.0.1:5000)
+    BCL_WORKERS    число процессов (по умолчанию — число CPU, не больше 8)
+    BCL_THREADS    потоков на процесс (по умолчанию 4)
+    BCL_TIMEOUT    таймаут запроса, сек (по умолчанию 30)
+
+SQLite допускает одного писателя за раз: каждый воркер пишет через свой
+поток-писатель, конкурирующие транзакции ждут busy_timeout. Поэтому
+воркеров больше числа ядер ставить нет смысла.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get("BCL_BIND", "127.0.0.1:5000")
+workers = int(os.environ.get("BCL_WORKERS", min(multiprocessing.cpu_count(), 8)))
+threads = int(os.environ.get("BCL_THREADS", "4"))
+worker_class = "gthread"
+
+# Миграции и импорт CSV выполняются один раз в мастере (create_app в wsgi.py),
+# воркеры получают уже готовое приложение через fork. Мастер пул соединений
+# не открывает: прогрев (warm_up) — только в воркере, в post_worker_init
+preload_app = True
+
+timeout = int(os.environ.get("BCL_TIMEOUT", "30"))
+graceful_timeout = 30
+keepalive = 5
+max_requests = 10000
+max_requests_jitter = 500
+
+accesslog = os.environ.get("BCL_ACCESS_LOG") or None
+errorlog = "-"
+
+
+def post_fork(server, worker):
+    # Пул соединений и поток-писатель сбрасываются при fork автоматически
+    # (os.register_at_fork в database.connection / database.writer)
+    server.log.info("worker %s started", worker.pid)
+
+
+def post_worker_init(worker):
+    # Воркер начинает принимать запросы после возврата из этого хука
+    from api.server import set_server_threads, warm_up
+
+    set_server_threads(worker.cfg.threads)
+    warm_up()
+
+
+def worker_exit(server, worker):
+    from api.server import shutdown
+
+    shutdown()
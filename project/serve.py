@@ -0,0 +1,30 @@
+"""
+Запуск API без gunicorn (например, на Windows): один процесс, пул потоков waitress.
+
+    python serve.py
+
+BCL_BIND и BCL_THREADS — как в gunicorn.conf.py.
+"""
+import os
+
+from api.server import create_app, set_server_threads, shutdown, warm_up
+
+
+def main():
+    from waitress import serve
+
+    host, _, port = os.environ.get("BCL_BIND", "127.0.0.1:5000").rpartition(":")
+    threads = int(os.environ.get("BCL_THREADS", "8"))
+
+    app = create_app(warm=False)
+    set_server_threads(threads)
+    warm_up()
+    print(f">>> Server running on http://{host}:{port} ({threads} threads)")
+    try:
+        serve(app, host=host, port=int(port), threads=threads)
+    finally:
+        shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,7 @@
+import json
+import queue
+import threading
+import time
 import tkinter as tk
 from tkinter import ttk, messagebox
 import requests
@@ -5,6 +9,7 @@ from requests.auth import HTTPBasicAuth
 
 API_URL = "http://127.0.0.1:5000/api"
 AUTH = HTTPBasicAuth("staff", "BCLyon2024")
+EVENT_POLL_MS = 200    # период разбора очереди событий в потоке Tk
 
 
 def show_error(msg):
@@ -18,6 +23,10 @@ def show_info(msg):
 class Session3OrdersFrame(ttk.Frame):
     def __init__(self, master):
         super().__init__(master)
+        # События от фонового потока; в потоке Tk их разбирает drain_events
+        # (Tkinter не потокобезопасен — из потока нельзя даже вызвать after)
+        self.events = queue.Queue()
+        self.drain_job = None
         self.build_ui()
 
     # =====================================================
@@ -27,6 +36,10 @@ class Session3OrdersFrame(ttk.Frame):
 
         ttk.Button(top, text="Обновить", command=self.load_orders).pack(side="left")
         ttk.Button(top, text="Создать заказ", command=self.new_order_window).pack(side="left", padx=5)
+        ttk.Button(top, text="Выполнить выбранные",
+                   command=lambda: self.update_selected("Completed")).pack(side="left", padx=5)
+        ttk.Button(top, text="Отменить выбранные",
+                   command=lambda: self.update_selected("Cancelled")).pack(side="left")
 
         # Поиск
         self.search_var = tk.StringVar()
@@ -55,6 +68,7 @@ class Session3OrdersFrame(ttk.Frame):
         self.table.bind("<Double-1>", self.on_open)
 
         self.load_orders()
+        self.start_event_listener()
 
     # =====================================================
     def load_orders(self):
@@ -67,16 +81,104 @@ class Session3OrdersFrame(ttk.Frame):
             data = r.json()
             self.table.delete(*self.table.get_children())
             for o in data:
-                self.table.insert("", "end", values=(
-                    o["id"],
-                    o["customer_name"],
-                    o["order_date"],
-                    o["total_amount"],
-                    o["status"],
-                ))
+                self.table.insert("", "end", iid=str(o["id"]), values=self.order_values(o))
         except Exception as e:
             show_error(str(e))
 
+    @staticmethod
+    def order_values(o):
+        return (o["id"], o["customer_name"], o["order_date"], o["total_amount"], o["status"])
+
+    # =====================================================
+    #      СОБЫТИЯ ЗАКАЗОВ (SSE /api/orders/events)
+    # =====================================================
+    def start_event_listener(self):
+        threading.Thread(target=self.listen_events, daemon=True).start()
+        self.drain_events()
+
+    def drain_events(self):
+        """Поток Tk: применяет накопленные события и планирует следующий опрос очереди."""
+        try:
+            while True:
+                self.apply_event(*self.events.get_nowait())
+        except queue.Empty:
+            pass
+        self.drain_job = self.after(EVENT_POLL_MS, self.drain_events)
+
+    def destroy(self):
+        if self.drain_job is not None:
+            self.after_cancel(self.drain_job)
+            self.drain_job = None
+        super().destroy()
+
+    def listen_events(self):
+        """Фоновый поток: читает поток событий и переподключается с Last-Event-ID."""
+        last_id = None
+        while True:
+            headers = {"Accept": "text/event-stream"}
+            if last_id:
+                headers["Last-Event-ID"] = last_id
+            try:
+                with requests.get(f"{API_URL}/orders/events", auth=AUTH, headers=headers,
+                                  stream=True, timeout=(5, 60)) as r:
+                    if r.status_code != 200:
+                        # Подписку не приняли (например, все слоты заняты) —
+                        # догоняем изменения обычным запросом
+                        if last_id:
+                            last_id = self.poll_changes(last_id)
+                        time.sleep(5)
+                        continue
+                    event = {}
+                    for line in r.iter_lines(decode_unicode=True):
+                        if line:
+                            name, _, value = line.partition(":")
+                            event[name] = value.strip()
+                            continue
+                        if "id" in event:
+                            last_id = event["id"]
+                        if "event" in event:
+                            self.events.put((event["event"], event.get("data")))
+                        event = {}
+            except Exception:
+                time.sleep(3)
+
+    def poll_changes(self, since):
+        """Изменения заказов после версии since через /orders/changes; возвращает новую версию."""
+        try:
+            while True:
+                r = requests.get(f"{API_URL}/orders/changes", auth=AUTH,
+                                 params={"since": since}, timeout=10)
+                if r.status_code != 200:
+                    return since
+                body = r.json()
+                for order in body["changed"]:
+                    self.events.put(("order.status", json.dumps(order)))
+                for oid in body["deleted"]:
+                    self.events.put(("order.deleted", json.dumps({"id": oid})))
+                since = str(body["version"])
+                if not body["has_more"]:
+                    return since
+        except Exception:
+            return since
+
+    def apply_event(self, event_type, data):
+        """Обновляет одну строку таблицы (вызывается в потоке Tk)."""
+        if event_type == "reset":
+            self.load_orders()
+            return
+        order = json.loads(data or "{}")
+        if "id" not in order:
+            return
+        iid = str(order["id"])
+        if event_type == "order.deleted":
+            if self.table.exists(iid):
+                self.table.delete(iid)
+            return
+        if self.table.exists(iid):
+            self.table.item(iid, values=self.order_values(order))
+        else:
+            self.table.insert("", 0, iid=iid, values=self.order_values(order))
+
     def search_orders(self):
         text = self.search_var.get().lower()
         for row in self.table.get_children():
@@ -173,6 +275,28 @@ class Session3OrdersFrame(ttk.Frame):
         except Exception as e:
             show_error(str(e))
 
+    def update_selected(self, status):
+        """Меняет статус всех выделенных заказов одним запросом."""
+        ids = [self.table.item(row)["values"][0] for row in self.table.selection()]
+        if not ids:
+            show_error("Выберите заказы в таблице")
+            return
+        try:
+            r = requests.post(f"{API_URL}/orders/status", json={"ids": ids, "status": status}, auth=AUTH)
+            if r.status_code != 200:
+                show_error(r.text)
+                return
+
+            summary = r.json()["summary"]
+            skipped = len(ids) - summary.get("ok", 0)
+            msg = f"Обновлено заказов: {summary.get('ok', 0)}"
+            if skipped:
+                msg += f", пропущено: {skipped}"
+            show_info(msg)
+            self.load_orders()
+        except Exception as e:
+            show_error(str(e))
+
     # =====================================================
     #                СОЗДАНИЕ НОВОГО ЗАКАЗА
     # =====================================================
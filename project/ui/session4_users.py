@@ -45,6 +45,7 @@ class Session4UsersFrame(ttk.Frame):
         ttk.Button(login, text="Login", command=self.do_login).pack(padx=10, pady=5)
 
         # Profile
+        self.token = None
         self.current_user_id = tk.StringVar()
         self.prof_email = tk.StringVar()
         self.prof_fname = tk.StringVar()
@@ -53,7 +54,7 @@ class Session4UsersFrame(ttk.Frame):
 
         row = ttk.Frame(profile); row.pack(fill="x", pady=2)
         ttk.Label(row, text="User ID:").pack(side="left", padx=5)
-        ttk.Entry(row, textvariable=self.current_user_id).pack(side="left", padx=5)
+        ttk.Entry(row, textvariable=self.current_user_id, state="readonly").pack(side="left", padx=5)
         ttk.Button(row, text="Load", command=self.load_profile).pack(side="left", padx=5)
 
         for text, var in [("Email", self.prof_email),
@@ -93,6 +94,7 @@ class Session4UsersFrame(ttk.Frame):
             })
             if r.ok:
                 uid = r.json()["user_id"]
+                self.token = r.json()["token"]
                 self.current_user_id.set(str(uid))
                 messagebox.showinfo("OK", f"Logged in as id={uid}")
             else:
@@ -100,10 +102,12 @@ class Session4UsersFrame(ttk.Frame):
         except Exception as e:
             messagebox.showerror("Error", str(e))
 
+    def auth_headers(self):
+        return {"Authorization": f"Bearer {self.token}"} if self.token else {}
+
     def load_profile(self):
-        uid = self.current_user_id.get()
         try:
-            r = requests.get(f"{API_BASE}/api/profile", params={"user_id": uid})
+            r = requests.get(f"{API_BASE}/api/profile", headers=self.auth_headers())
             if r.ok:
                 data = r.json()
                 self.prof_email.set(data["email"])
@@ -116,16 +120,14 @@ class Session4UsersFrame(ttk.Frame):
             messagebox.showerror("Error", str(e))
 
     def save_profile(self):
-        uid = self.current_user_id.get()
         data = {
-            "id": uid,
             "email": self.prof_email.get(),
             "first_name": self.prof_fname.get(),
             "last_name": self.prof_lname.get(),
             "phone": self.prof_phone.get(),
         }
         try:
-            r = requests.put(f"{API_BASE}/api/profile", json=data)
+            r = requests.put(f"{API_BASE}/api/profile", json=data, headers=self.auth_headers())
             if r.ok:
                 messagebox.showinfo("OK", "Profile updated")
             else:
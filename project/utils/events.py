@@ -0,0 +1,40 @@
+import threading
+
+# ======================================================================
+# Будильник для потоков SSE.
+#
+# Сами события берутся из общей для всех процессов таблицы row_changes
+# (см. api/server.py), поэтому поток видит и записи других воркеров —
+# их он находит, перечитывая таблицу раз в интервал опроса. notify()
+# после записи в этом процессе будит ждущие потоки сразу, не дожидаясь
+# следующего опроса.
+# ======================================================================
+
+
+class ChangeNotifier:
+    def __init__(self):
+        self._seq = 0
+        self._cond = threading.Condition()
+
+    def notify(self):
+        with self._cond:
+            self._seq += 1
+            self._cond.notify_all()
+
+    def current(self):
+        with self._cond:
+            return self._seq
+
+    def wait(self, seen, timeout):
+        """
+        Ждёт notify() после момента, когда был получен номер seen
+        (не дольше timeout сек). Возвращает текущий номер.
+        """
+        with self._cond:
+            if self._seq <= seen:
+                self._cond.wait(timeout)
+            return self._seq
+
+    def stats(self):
+        with self._cond:
+            return {"notifications": self._seq}
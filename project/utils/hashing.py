@@ -1,15 +1,206 @@
 import hashlib
+import hmac
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# ======================================================================
+# Хеширование паролей.
+#
+# Формат хранит схему и параметры стоимости вместе с солью:
+#     scrypt$n=16384,r=8,p=1$<salt>$<hash>
+#     pbkdf2_sha256$i=600000$<salt>$<hash>
+# Старые хеши «salt$sha256» по-прежнему проверяются; needs_rehash()
+# сообщает, что хеш пора пересчитать с текущими параметрами.
+# ======================================================================
+
+HASH_SCHEME = os.environ.get(
+    "BCL_HASH_SCHEME", "scrypt" if hasattr(hashlib, "scrypt") else "pbkdf2_sha256"
+)
+SCRYPT_PARAMS = {
+    "n": int(os.environ.get("BCL_SCRYPT_N", "16384")),
+    "r": int(os.environ.get("BCL_SCRYPT_R", "8")),
+    "p": int(os.environ.get("BCL_SCRYPT_P", "1")),
+}
+PBKDF2_PARAMS = {"i": int(os.environ.get("BCL_PBKDF2_ITERATIONS", "600000"))}
+
+
+def _current_params(scheme: str) -> dict:
+    return dict(SCRYPT_PARAMS) if scheme == "scrypt" else dict(PBKDF2_PARAMS)
+
+
+def _derive(scheme: str, params: dict, password: str, salt: str) -> str:
+    data = password.encode("utf-8")
+    if scheme == "scrypt":
+        n, r, p = params["n"], params["r"], params["p"]
+        return hashlib.scrypt(
+            data, salt=salt.encode("ascii"), n=n, r=r, p=p, maxmem=256 * n * r + 1024 * 1024
+        ).hex()
+    if scheme == "pbkdf2_sha256":
+        return hashlib.pbkdf2_hmac("sha256", data, salt.encode("ascii"), params["i"]).hex()
+    raise ValueError(f"unknown hash scheme: {scheme}")
+
+
+def _format_params(params: dict) -> str:
+    return ",".join(f"{k}={v}" for k, v in params.items())
+
+
+def _parse(stored: str):
+    """(scheme, params, salt, hash) или None для нераспознанной строки."""
+    parts = (stored or "").split("$")
+    if len(parts) == 2:
+        return "sha256", {}, parts[0], parts[1]
+    if len(parts) != 4:
+        return None
+    scheme, raw_params, salt, digest = parts
+    try:
+        params = {k: int(v) for k, v in (item.split("=", 1) for item in raw_params.split(","))}
+    except ValueError:
+        return None
+    return scheme, params, salt, digest
+
 
 def hash_password(password: str, salt: str | None = None) -> str:
     if salt is None:
         salt = os.urandom(16).hex()
-    h = hashlib.sha256((salt + password).encode("utf-8")).hexdigest()
-    return f"{salt}${h}"
+    params = _current_params(HASH_SCHEME)
+    digest = _derive(HASH_SCHEME, params, password, salt)
+    return f"{HASH_SCHEME}${_format_params(params)}${salt}${digest}"
+
 
 def verify_password(password: str, stored: str) -> bool:
-    try:
-        salt, _hash = stored.split("$", 1)
-    except ValueError:
+    parsed = _parse(stored)
+    if parsed is None:
         return False
-    return hash_password(password, salt) == stored
+    scheme, params, salt, digest = parsed
+    if scheme == "sha256":
+        expected = hashlib.sha256((salt + password).encode("utf-8")).hexdigest()
+    else:
+        try:
+            expected = _derive(scheme, params, password, salt)
+        except (KeyError, ValueError):
+            return False
+    return hmac.compare_digest(expected, digest)
+
+
+def dummy_hash() -> str:
+    """
+    Хеш с текущими параметрами, которому не соответствует ни один
+    пароль: login проверяет по нему пароль неизвестного email, чтобы
+    ответ занимал столько же времени, сколько для существующего.
+    """
+    params = _current_params(HASH_SCHEME)
+    return f"{HASH_SCHEME}${_format_params(params)}${'0' * 32}$"
+
+
+def needs_rehash(stored: str) -> bool:
+    parsed = _parse(stored)
+    if parsed is None:
+        return True
+    scheme, params, _, _ = parsed
+    return scheme != HASH_SCHEME or params != _current_params(scheme)
+
+
+# ======================================================================
+# Пул хеширования.
+#
+# KDF намеренно медленный, поэтому register / login считают его не в
+# потоке запроса, а в ограниченном пуле (hashlib отпускает GIL). Число
+# одновременно принятых задач ограничено: при перегрузке новый запрос
+# ждёт место не дольше HASH_ADMISSION_WAIT и получает HashingBusy (503),
+# а остальные эндпоинты продолжают работать в обычном режиме.
+# ======================================================================
+
+HASH_WORKERS = int(os.environ.get("BCL_HASH_WORKERS", str(os.cpu_count() or 2)))
+HASH_QUEUE = int(os.environ.get("BCL_HASH_QUEUE", str(4 * HASH_WORKERS)))
+HASH_ADMISSION_WAIT = float(os.environ.get("BCL_HASH_ADMISSION_WAIT", "0.5"))
+
+
+class HashingBusy(Exception):
+    """Пул хеширования перегружен — запрос стоит повторить позже."""
+
+
+class HashingPool:
+    def __init__(self, workers=HASH_WORKERS, queue_size=HASH_QUEUE, wait=HASH_ADMISSION_WAIT):
+        self.workers = workers
+        self.capacity = workers + queue_size
+        self.wait = wait
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hashing")
+        self._slots = threading.BoundedSemaphore(self.capacity)
+        self._lock = threading.Lock()
+        self._stats = {"tasks": 0, "rejected": 0, "skipped": 0, "busy_time": 0.0, "in_flight": 0}
+
+    def _admit(self, timeout):
+        if not self._slots.acquire(timeout=timeout):
+            with self._lock:
+                self._stats["rejected"] += 1
+            return False
+        with self._lock:
+            self._stats["in_flight"] += 1
+        return True
+
+    def _submit(self, fn, *args):
+        def task():
+            started = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self._stats["tasks"] += 1
+                    self._stats["in_flight"] -= 1
+                    self._stats["busy_time"] += time.perf_counter() - started
+                self._slots.release()
+
+        return self._executor.submit(task)
+
+    def run(self, fn, *args):
+        """Выполняет fn(*args) в пуле и ждёт результат; HashingBusy при перегрузке."""
+        if not self._admit(self.wait):
+            raise HashingBusy("password hashing is overloaded, retry later")
+        return self._submit(fn, *args).result()
+
+    def run_background(self, fn, *args):
+        """Фоновая задача без ожидания; при занятом пуле просто пропускается."""
+        if not self._admit(0):
+            with self._lock:
+                self._stats["skipped"] += 1
+            return None
+        return self._submit(fn, *args)
+
+    def hash(self, password: str) -> str:
+        return self.run(hash_password, password)
+
+    def verify(self, password: str, stored: str) -> bool:
+        return self.run(verify_password, password, stored)
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+        data["workers"] = self.workers
+        data["capacity"] = self.capacity
+        data["scheme"] = HASH_SCHEME
+        return data
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_hashing_pool() -> HashingPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = HashingPool()
+    return _pool
+
+
+def _reset_after_fork():
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
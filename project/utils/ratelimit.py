@@ -0,0 +1,102 @@
+import math
+import os
+import threading
+import time
+
+# ======================================================================
+# Ограничение частоты запросов: token bucket на пару (клиент, класс маршрута).
+#
+# Класс маршрута задаёт скорость пополнения (запросов/сек) и размер
+# корзины (допустимый всплеск). Корзины разных классов независимы,
+# поэтому отчёты одного клиента не расходуют его лимит на заказы.
+# ======================================================================
+
+# класс -> (запросов в секунду, всплеск, «дорогой» запрос)
+DEFAULT_LIMITS = {
+    "default": (20.0, 40, False),
+    "orders": (20.0, 50, False),     # оформление и статусы заказов
+    "reporting": (2.0, 5, True),     # полные списки и выгрузки
+}
+MAX_BUCKETS = 10000
+
+
+def parse_limits(spec, base=None):
+    """
+    "reporting=2/5,orders=20/50" -> {класс: (rate, burst, expensive)}.
+    Неуказанные классы берутся из base; признак «дорогой» не меняется.
+    """
+    limits = dict(base or DEFAULT_LIMITS)
+    for item in filter(None, (s.strip() for s in (spec or "").split(","))):
+        name, _, value = item.partition("=")
+        rate, _, burst = value.partition("/")
+        expensive = limits.get(name, (0, 0, False))[2]
+        limits[name.strip()] = (float(rate), int(burst or math.ceil(float(rate))), expensive)
+    return limits
+
+
+class TokenBucketLimiter:
+    def __init__(self, limits):
+        self.limits = limits
+        self._buckets = {}      # (client, class) -> [tokens, last_refill]
+        self._lock = threading.Lock()
+
+    def acquire(self, client, route_class):
+        """
+        Забирает токен. Возвращает 0, если запрос разрешён, иначе — через
+        сколько секунд появится следующий токен.
+        """
+        rate, burst, _ = self.limits.get(route_class, self.limits["default"])
+        now = time.monotonic()
+        key = (client, route_class)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= MAX_BUCKETS:
+                    self._evict(now)
+                bucket = self._buckets[key] = [float(burst), now]
+            tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                return 0.0
+            bucket[0] = tokens
+        return (1 - tokens) / rate if rate > 0 else 60.0
+
+    def _evict(self, now):
+        """Удаляет корзины, которые уже успели наполниться (клиент давно не заходил)."""
+        for key in list(self._buckets):
+            rate, burst, _ = self.limits.get(key[1], self.limits["default"])
+            tokens, last = self._buckets[key]
+            if tokens + (now - last) * rate >= burst:
+                del self._buckets[key]
+
+    def stats(self):
+        with self._lock:
+            return {"buckets": len(self._buckets)}
+
+
+class ConcurrencyLimit:
+    """Глобальный предел одновременных «дорогих» запросов (неблокирующий)."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._slots = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+        self.active = 0
+
+    def try_acquire(self):
+        if not self._slots.acquire(blocking=False):
+            return False
+        with self._lock:
+            self.active += 1
+        return True
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+        self._slots.release()
+
+
+RATE_LIMITS = parse_limits(os.environ.get("BCL_RATE_LIMITS"))
+RATE_LIMIT_ENABLED = os.environ.get("BCL_RATE_LIMIT", "1") != "0"
+EXPENSIVE_CONCURRENCY = int(os.environ.get("BCL_EXPENSIVE_CONCURRENCY", "4"))
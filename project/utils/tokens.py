@@ -0,0 +1,84 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+
+from utils.cache import TTLCache
+
+# ======================================================================
+# Подписанные сессионные токены: base64url(payload).base64url(HMAC-SHA256).
+# Проверка не обращается к БД и не хеширует пароль: только HMAC, срок
+# действия и кеш отозванных токенов в памяти.
+#
+# Секрет — BCL_SESSION_SECRET; без него приложение при старте передаёт
+# в set_secret() общий секрет из БД (api/server.py), чтобы токен одного
+# процесса принимали все воркеры. Отзывы тоже хранятся в БД, а в этот
+# кеш их подгружает revoke_jti().
+# ======================================================================
+
+TOKEN_TTL = int(os.environ.get("BCL_SESSION_TTL", "3600"))
+REVOKED_MAX = 100000
+
+ENV_SECRET = os.environ.get("BCL_SESSION_SECRET", "").encode("utf-8")
+
+_secret = ENV_SECRET or os.urandom(32)
+_revoked = TTLCache(maxsize=REVOKED_MAX, ttl=TOKEN_TTL)
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def set_secret(secret: bytes) -> None:
+    """Секрет подписи, общий для всех процессов (если не задан BCL_SESSION_SECRET)."""
+    global _secret
+    _secret = secret
+
+
+def _sign(payload: str) -> str:
+    return _b64encode(hmac.new(_secret, payload.encode("ascii"), hashlib.sha256).digest())
+
+
+def issue_token(user_id: int, ttl: int | None = None) -> tuple[str, int]:
+    """Возвращает (токен, время истечения в секундах epoch)."""
+    expires = int(time.time()) + (ttl or TOKEN_TTL)
+    claims = {"sub": user_id, "exp": expires, "jti": os.urandom(8).hex()}
+    payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+    return f"{payload}.{_sign(payload)}", expires
+
+
+def verify_token(token: str) -> dict | None:
+    """Claims токена ({"sub", "exp", "jti"}) или None, если он недействителен."""
+    if not token or not token.isascii():
+        return None
+    payload, _, signature = token.partition(".")
+    if not payload or not hmac.compare_digest(signature, _sign(payload)):
+        return None
+    try:
+        claims = json.loads(_b64decode(payload))
+    except ValueError:
+        return None
+    if claims.get("exp", 0) <= time.time():
+        return None
+    if _revoked.get(claims.get("jti")) is not None:
+        return None
+    return claims
+
+
+def revoke_jti(jti: str, expires: float) -> None:
+    _revoked.set(jti, expires)
+
+
+def revoke_token(token: str) -> dict | None:
+    """Отзывает токен в этом процессе. Возвращает его claims (или None)."""
+    claims = verify_token(token)
+    if claims is None:
+        return None
+    revoke_jti(claims["jti"], claims["exp"])
+    return claims
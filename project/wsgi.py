@@ -0,0 +1,13 @@
+"""
+WSGI-точка входа для production-серверов.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+    waitress-serve --threads=8 --call wsgi:create_app   (или python serve.py)
+
+С preload_app модуль загружается в мастере gunicorn: здесь только
+миграции, без прогрева — пул соединений открывает каждый воркер сам
+(warm_up() в post_worker_init).
+"""
+from api.server import create_app
+
+app = application = create_app(warm=False)